@@ -0,0 +1,66 @@
+"""This file compares the binned counts in a single pass through the sorted values with the
+earlier implementation, which selects the values within each bin separately, on a synthetic
+extract. Run it from the root of the repository.
+"""
+
+# %%
+import numpy as np
+
+from bench_utils import use_synthetic_data
+from bench_utils import time_function
+from synthetic_data import NUM_AGENTS
+
+from setup_classobj import get_binned_counts_by_year
+from setup_classobj import _get_counts_year
+from setup_classobj import SourceCls
+from setup_calendar import CALENDAR
+
+# %%
+# The bins of the variable EMP_STATUS_WK_, where the first one overlaps with the others.
+BINS = [(100, np.inf), (0, 0), (2, 2), (3, 3), (4, 4), (5, 5), (7, 7)]
+
+
+# %%
+def get_counts_year_between(series, bins, year):
+    """ This is the earlier implementation, which counts the values within each bin separately.
+    """
+    counts = []
+    for bounds in bins:
+        lower, upper = bounds
+        counts += [series.loc[:, year].between(lower, upper).sum()]
+
+    return counts
+
+
+# %%
+if __name__ == '__main__':
+
+    use_synthetic_data(NUM_AGENTS)
+
+    # The weekly employment status is available for all years in the calendar.
+    source_obj = SourceCls()
+    source_obj.read_source()
+    source_obj.transform_wide_to_panel()
+    source_obj.add_basic_variables()
+    series = source_obj.get_annual_grid()['EMP_STATUS_WK_1']
+
+    def count_between():
+        return [get_counts_year_between(series, BINS, year) for year in CALENDAR.years]
+
+    def count_sorted():
+        return [_get_counts_year(series, BINS, year) for year in CALENDAR.years]
+
+    def count_matrix():
+        return get_binned_counts_by_year(series, BINS).values.tolist()
+
+    rslt_between, time_between = time_function(count_between)
+    rslt_sorted, time_sorted = time_function(count_sorted)
+    rslt_matrix, time_matrix = time_function(count_matrix)
+
+    np.testing.assert_equal(rslt_between, rslt_sorted)
+    np.testing.assert_equal(rslt_between, rslt_matrix)
+
+    print('{:<24}{:>12}{:>10}'.format('Counts for all years', 'Seconds', 'Speedup'))
+    for label, value in [('between', time_between), ('sorted, each year', time_sorted),
+                         ('sorted, matrix', time_matrix)]:
+        print('{:<24}{:>12.4f}{:>9.1f}x'.format(label, value, time_between / value))
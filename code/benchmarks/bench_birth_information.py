@@ -0,0 +1,66 @@
+"""This file compares the vectorized aggregation of the birth information with the earlier
+implementation, which applies a function to each respondent separately, on synthetic extracts.
+Run it from the root of the repository.
+"""
+
+# %%
+import pandas as pd
+import numpy as np
+
+from bench_utils import use_synthetic_data
+from bench_utils import time_function
+from synthetic_data import NUM_AGENTS
+
+from setup_additional_vars import aggregate_birth_information
+from setup_classobj import SourceCls
+
+
+# %%
+def aggregate_birth_information_apply(df):
+    """ This is the earlier implementation, which constructs the birth information for each
+    respondent in a separate function call.
+    """
+    def _construct_birth_info(agent):
+        for substring in ['YEAR_OF_BIRTH', 'MONTH_OF_BIRTH']:
+            for year in [1979, 1981]:
+                agent[substring + '_' + str(year)] = agent[substring][:, year].values[0]
+            agent[substring] = np.nan
+            agent[substring] = agent[substring + '_1981']
+            if agent[substring].isnull().values.any():
+                agent[substring] = agent[substring + '_1979']
+
+        return agent
+
+    df = df.groupby(level='Identifier', group_keys=False).apply(_construct_birth_info)
+
+    for substring in ['YEAR_OF_BIRTH', 'MONTH_OF_BIRTH']:
+        for year in [1979, 1981]:
+            del df[substring + '_' + str(year)]
+
+    df['YEAR_OF_BIRTH'] += 1900
+
+    return df
+
+
+# %%
+if __name__ == '__main__':
+
+    # The earlier implementation scales linearly in the number of respondents in Python, so
+    # it is only timed for a subset of the cohort.
+    print('{:>12}{:>14}{:>16}{:>10}'.format('Respondents', 'Apply (s)', 'Vectorized (s)', 'Speedup'))
+    for num_agents in [1000, NUM_AGENTS]:
+        use_synthetic_data(num_agents)
+
+        source_obj = SourceCls()
+        source_obj.read_source()
+        source_obj.transform_wide_to_panel()
+        df = source_obj.source_long
+
+        rslt_apply, time_apply = time_function(aggregate_birth_information_apply, df.copy())
+        rslt_vectorized, time_vectorized = time_function(aggregate_birth_information, df.copy())
+
+        for substring in ['YEAR_OF_BIRTH', 'MONTH_OF_BIRTH']:
+            pd.testing.assert_series_equal(rslt_apply[substring], rslt_vectorized[substring])
+
+        print('{:>12}{:>14.3f}{:>16.3f}{:>9.1f}x'.format(num_agents, time_apply, time_vectorized,
+                                                       time_apply / time_vectorized))
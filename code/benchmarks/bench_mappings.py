@@ -0,0 +1,59 @@
+"""This file reports the startup latency of the variable mappings, comparing a cold
+start (resolving the mappings from the sdf file) with a warm start (reading them from
+the persistent cache). Run it from the root of the repository.
+"""
+
+# %%
+import tempfile
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import setup_dct
+
+
+# %%
+def time_mappings(num_repeats=5):
+    """ This function returns the best of several timings for a cold and a warm start.
+    """
+    cache_dir = setup_dct.CACHE_DIR
+    timings = {'cold': [], 'warm': []}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        setup_dct.CACHE_DIR = tmp_dir
+        try:
+            for _ in range(num_repeats):
+                # A cold start has neither the parsed sdf file nor the cache available.
+                setup_dct.CATALOGS.clear()
+                for fname in os.listdir(tmp_dir):
+                    os.remove(os.path.join(tmp_dir, fname))
+
+                start = time.perf_counter()
+                cold = setup_dct.get_mappings()
+                timings['cold'] += [time.perf_counter() - start]
+
+                setup_dct.CATALOGS.clear()
+
+                start = time.perf_counter()
+                warm = setup_dct.get_mappings()
+                timings['warm'] += [time.perf_counter() - start]
+
+                # The cache needs to return exactly what was resolved.
+                assert cold == warm
+        finally:
+            setup_dct.CACHE_DIR = cache_dir
+
+    return {label: min(values) for label, values in timings.items()}
+
+
+# %%
+if __name__ == '__main__':
+
+    rslt = time_mappings()
+
+    print('{:<10}{:>12}'.format('Start', 'Seconds'))
+    for label in ['cold', 'warm']:
+        print('{:<10}{:>12.4f}'.format(label, rslt[label]))
+    print('{:<10}{:>11.1f}x'.format('speedup', rslt['cold'] / rslt['warm']))
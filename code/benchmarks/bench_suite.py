@@ -0,0 +1,461 @@
+"""This file runs the benchmarks for the hot paths of the data preparation, from the variable
+mappings to the plots, and records the wall time and the peak memory of each. Every benchmark
+runs in a separate process, whose peak resident set size covers the buffers of numpy and
+pyarrow, but also the preparation of the input. The peak of the Python allocations traced
+during a call of the benchmarked function is recorded as well. The results are
+written to a JSON file, which can serve as the baseline for a later run. Run it from the root
+of the repository, e.g.
+
+    python code/benchmarks/bench_suite.py --output baseline.json
+    python code/benchmarks/bench_suite.py --baseline baseline.json --threshold 0.25
+
+for the original extract, or with --scale 10 for a synthetic extract with ten times as many
+respondents. Benchmarks that fail are reported along with their error. The plot scripts are
+skipped if matplotlib is not installed. The consistency checks compare with counts from the
+original extract, so they are not run on a synthetic extract by default.
+"""
+
+# %%
+from functools import partial
+import subprocess
+import shutil
+import importlib.util
+import tracemalloc
+import argparse
+import platform
+import runpy
+import json
+import re
+import time
+import sys
+import os
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # The peak resident set size is not available on Windows.
+    resource = None
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CODE_DIR)
+
+from synthetic_data import NUM_AGENTS
+from bench_utils import use_synthetic_data
+from setup_store import DERIVED
+
+# %%
+# The plot scripts and the directories they need to be run from, relative to the root.
+PLOTS = [('plots_dataset_overview.py', '.'), ('plots_apt_att_measures.py', '.'),
+         ('plots_apt_att_gender.py', '.'), ('plots_exploratory.py', 'code')]
+
+# The plot scripts need matplotlib, which the data preparation does not.
+REQUIREMENTS = {script[:-3]: 'matplotlib' for script, _ in PLOTS}
+
+
+# %%
+def setup_mappings():
+    """ This function clears the parsed sdf file, so the mappings are resolved from scratch.
+    """
+    import setup_dct
+    setup_dct.CATALOGS.clear()
+
+    return ()
+
+
+# %%
+def setup_read_source():
+    """ This function makes sure the mappings are in the cache, so only the reading of the
+    original file is timed.
+    """
+    from setup_dct import get_mappings
+    get_mappings()
+
+    return ()
+
+
+# %%
+def setup_source():
+    """ This function returns the instance of the class after reading the original file, with
+    the mappings taken from the cache.
+    """
+    from setup_classobj import SourceCls
+
+    source_obj = SourceCls()
+    source_obj.read_source()
+
+    return source_obj
+
+
+# %%
+def setup_wide_to_long():
+    """ This function returns the arguments for the transformation to the panel.
+    """
+    source_obj = setup_source()
+
+    return source_obj.source_wide, source_obj.survey_years, source_obj.dct
+
+
+# %%
+def setup_source_long():
+    """ This function returns the panel before the recoding of missing values.
+    """
+    from setup_classobj import wide_to_long
+
+    return (wide_to_long(*setup_wide_to_long()),)
+
+
+# %%
+def setup_panel():
+    """ This function returns the panel after the recoding of missing values.
+    """
+    source_obj = setup_source()
+    source_obj.transform_wide_to_panel()
+
+    return (source_obj.source_long,)
+
+
+# %%
+def setup_test_afqt():
+    """ This function returns the raw AFQT score and the AFQT percentile for each respondent.
+    """
+    from setup_additional_vars import calculate_afqt_scores
+
+    df = calculate_afqt_scores(setup_panel()[0])
+    df = df[['AFQT_RAW', 'AFQT_1']].groupby(level='Identifier').first()
+
+    return tuple(df[label].to_numpy(dtype='float64', na_value=np.nan) for label in df.columns)
+
+
+# %%
+def setup_testing():
+    """ This function returns the instance of the class with all basic variables added.
+    """
+    source_obj = setup_source()
+    source_obj.transform_wide_to_panel()
+    source_obj.add_basic_variables()
+
+    return (source_obj,)
+
+
+# %%
+def setup_store():
+    """ This function writes the panel to the store in data/all-vars, unless it is there.
+    """
+    if not os.path.exists('data/all-vars'):
+        source_obj, = setup_testing()
+        source_obj.store('data/all-vars')
+
+    # The dataset is kept once loaded, so each repetition imports its module again. The derived
+    # variables kept in the store are removed, so they are computed every time.
+    sys.modules.pop('setup_fin_dataset', None)
+    shutil.rmtree(os.path.join('data/all-vars', DERIVED), ignore_errors=True)
+
+    return ()
+
+
+# %%
+def setup_plot(dirname):
+    """ This function prepares the directories a plot script reads from and writes to.
+    """
+    setup_store()
+
+    os.makedirs(dirname, exist_ok=True)
+    os.makedirs(os.path.join('out', 'heatmaps'), exist_ok=True)
+
+    return ()
+
+
+# %%
+def run_read_source():
+    """ Read the original file, with the mappings taken from the cache.
+    """
+    from setup_classobj import SourceCls
+    SourceCls().read_source()
+
+
+# %%
+def run_get_mappings():
+    """ Resolve the mappings from the sdf file, bypassing the cache.
+    """
+    from setup_dct import get_mappings
+    get_mappings(use_cache=False)
+
+
+# %%
+def run_wide_to_long(source_wide, survey_years, dct):
+    """ Transform the original file to the panel.
+    """
+    from setup_classobj import wide_to_long
+    wide_to_long(source_wide, survey_years, dct)
+
+
+# %%
+def run_set_missing_values(source_long):
+    """ Recode the missing values in the panel.
+    """
+    from setup_classobj import set_missing_values
+    set_missing_values(source_long)
+
+
+# %%
+def run_derived_variable(name, source_long):
+    """ Compute a derived variable from the panel.
+    """
+    import setup_additional_vars
+    getattr(setup_additional_vars, name)(source_long)
+
+
+# %%
+def run_test_afqt(afqt_raw, afqt_1):
+    """ Reconstruct the AFQT percentile from the raw AFQT score.
+    """
+    from setup_additional_vars import _test_afqt
+    _test_afqt(afqt_raw, afqt_1)
+
+
+# %%
+def run_testing(source_obj):
+    """ Run the consistency checks for the panel.
+    """
+    source_obj.testing()
+
+
+# %%
+def run_get_dataset():
+    """ Load the dataset for the analysis, including the import of its module.
+    """
+    import setup_fin_dataset
+    setup_fin_dataset.get_dataset()
+
+
+# %%
+def run_plot(script, dirname):
+    """ Run a plot script from the directory it expects to be run from.
+    """
+    cwd = os.getcwd()
+    os.chdir(dirname)
+    try:
+        runpy.run_path(os.path.join(CODE_DIR, 'plots', script), run_name='__main__')
+    finally:
+        os.chdir(cwd)
+
+
+# %%
+def get_benchmarks():
+    """ This function returns the benchmarks, each as the function that prepares its input and
+    the function that is timed.
+    """
+    benchmarks = dict()
+    benchmarks['get_mappings'] = (setup_mappings, run_get_mappings)
+    benchmarks['read_source'] = (setup_read_source, run_read_source)
+    benchmarks['wide_to_long'] = (setup_wide_to_long, run_wide_to_long)
+    benchmarks['set_missing_values'] = (setup_source_long, run_set_missing_values)
+    for name in ['aggregate_birth_information', 'calculate_afqt_scores']:
+        benchmarks[name] = (setup_panel, partial(run_derived_variable, name))
+    benchmarks['_test_afqt'] = (setup_test_afqt, run_test_afqt)
+    benchmarks['testing'] = (setup_testing, run_testing)
+    benchmarks['get_dataset'] = (setup_store, run_get_dataset)
+    for script, dirname in PLOTS:
+        benchmarks[script[:-3]] = (partial(setup_plot, dirname), partial(run_plot, script, dirname))
+
+    return benchmarks
+
+
+# %%
+def run_benchmark(name, num_repeats):
+    """ This function runs a single benchmark in the current process and returns the wall time
+    of each repetition, the peak resident set size of the process, and the peak of the Python
+    allocations traced during a call of the benchmarked function.
+    """
+    setup, func = get_benchmarks()[name]
+
+    rslt = {'seconds': [], 'peak_rss_mb': None, 'peak_traced_mb': None}
+    for _ in range(num_repeats):
+        args = setup()
+
+        start = time.perf_counter()
+        func(*args)
+        rslt['seconds'] += [time.perf_counter() - start]
+
+    # The allocations are traced in a separate repetition, as tracing slows down the function.
+    args = setup()
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rslt['peak_traced_mb'] = peak / 1024 ** 2
+    rslt['peak_rss_mb'] = get_peak_rss()
+
+    return rslt
+
+
+# %%
+def get_peak_rss():
+    """ This function returns the peak resident set size of the process in megabytes.
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # The peak is reported in bytes on macOS and in kilobytes on Linux.
+    if sys.platform == 'darwin':
+        return peak / 1024 ** 2
+
+    return peak / 1024
+
+
+# %%
+def run_suite(names, num_repeats, label):
+    """ This function runs each benchmark in a separate process from the current directory and
+    returns the results along with some information on the environment.
+    """
+    results = dict()
+    results['label'] = label
+    results['created'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    results['python'] = platform.python_version()
+    results['platform'] = platform.platform()
+    results['benchmarks'] = dict()
+
+    env = dict(os.environ, MPLBACKEND='Agg')
+    for name in names:
+        module = REQUIREMENTS.get(name)
+        if module is not None and importlib.util.find_spec(module) is None:
+            rslt = {'status': 'skipped', 'error': module + ' is not installed'}
+            results['benchmarks'][name] = rslt
+            print_result(name, rslt)
+            continue
+
+        cmd = [sys.executable, os.path.abspath(__file__), '--run', name, '--repeats', str(num_repeats)]
+        proc = subprocess.run(cmd, capture_output=True, text=True, env=env)
+
+        if proc.returncode == 0:
+            rslt = json.loads(proc.stdout.strip().splitlines()[-1])
+            rslt['status'] = 'ok'
+        else:
+            rslt = {'status': 'failed', 'error': get_error(proc.stderr)}
+
+        results['benchmarks'][name] = rslt
+        print_result(name, rslt)
+
+    return results
+
+
+# %%
+def get_error(stderr):
+    """ This function returns the line of the traceback that names the exception.
+    """
+    lines = stderr.strip().splitlines()
+    errors = [line for line in lines if re.match(r'^[\w.]+(Error|Exception|Interrupt)\b', line)]
+    if errors:
+        return errors[-1]
+
+    return lines[-1] if lines else ''
+
+
+# %%
+def compare_results(results, baseline, threshold):
+    """ This function compares the best wall time and the peak memory of each benchmark with
+    the baseline. A benchmark is flagged if any of them exceeds the baseline by more than the
+    threshold, as a share of the baseline.
+    """
+    comparison = []
+    for name, rslt in results['benchmarks'].items():
+        rslt_base = baseline['benchmarks'].get(name, dict())
+        if rslt.get('status') != 'ok' or rslt_base.get('status') != 'ok':
+            continue
+        for metric in ['seconds', 'peak_rss_mb', 'peak_traced_mb']:
+            value, value_base = rslt.get(metric), rslt_base.get(metric)
+            if metric == 'seconds':
+                value, value_base = min(value), min(value_base)
+            if value is None or value_base is None:
+                continue
+            ratio = value / value_base
+            comparison += [(name, metric, value_base, value, ratio, ratio > 1 + threshold)]
+
+    return comparison
+
+
+# %%
+def print_result(name, rslt):
+    """ Print the best wall time and the peak memory of a benchmark.
+    """
+    if rslt['status'] != 'ok':
+        print('{:<32}{:>12}  {}'.format(name, rslt['status'], rslt['error']))
+        return
+
+    peak = rslt['peak_rss_mb']
+    print('{:<32}{:>12.4f}{:>14}{:>14.1f}'.format(name, min(rslt['seconds']),
+                                                  'n/a' if peak is None else '{:.1f}'.format(peak),
+                                                  rslt['peak_traced_mb']))
+
+
+# %%
+def print_comparison(comparison, threshold):
+    """ Print the comparison with the baseline and flag the regressions.
+    """
+    print('\n{:<32}{:<14}{:>12}{:>12}{:>10}'.format('Benchmark', 'Metric', 'Baseline', 'Current', 'Ratio'))
+    for name, metric, value_base, value, ratio, is_flagged in comparison:
+        flag = '  <- exceeds {:.0%}'.format(threshold) if is_flagged else ''
+        print('{:<32}{:<14}{:>12.4f}{:>12.4f}{:>10.2f}{}'.format(name, metric, value_base, value, ratio, flag))
+
+
+# %%
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths of the data preparation.')
+    parser.add_argument('--scale', type=int, default=0,
+                        help='multiple of the NLSY79 respondents for a synthetic extract (default: original extract)')
+    parser.add_argument('--benchmarks', nargs='+', default=None, help='benchmarks to run (default: all)')
+    parser.add_argument('--repeats', type=int, default=3, help='repetitions of each benchmark')
+    parser.add_argument('--output', default=None, help='JSON file for the results')
+    parser.add_argument('--baseline', default=None, help='JSON file with the results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='slowdown relative to the baseline that is flagged')
+    parser.add_argument('--run', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # A single benchmark runs in this process and reports to the suite.
+    if args.run is not None:
+        print(json.dumps(run_benchmark(args.run, args.repeats)))
+        sys.exit(0)
+
+    # The synthetic extract is in a different directory, so the files are located first.
+    fname_output, fname_baseline = args.output, args.baseline
+    if fname_output is not None:
+        fname_output = os.path.abspath(fname_output)
+    if fname_baseline is not None:
+        fname_baseline = os.path.abspath(fname_baseline)
+
+    names = args.benchmarks
+    if names is None:
+        names = list(get_benchmarks().keys())
+        # The consistency checks compare with counts from the original extract.
+        if args.scale > 0:
+            names.remove('testing')
+
+    # The synthetic extract has the same layout as the root of the repository.
+    label = 'original'
+    if args.scale > 0:
+        label = 'synthetic-' + str(args.scale) + 'x'
+        use_synthetic_data(NUM_AGENTS * args.scale, label)
+
+    print('{:<32}{:>12}{:>14}{:>14}'.format('Benchmark', 'Seconds', 'Peak RSS (MB)', 'Traced (MB)'))
+    results = run_suite(names, args.repeats, label)
+
+    if fname_output is not None:
+        with open(fname_output, 'w') as outfile:
+            json.dump(results, outfile, indent=4)
+
+    if fname_baseline is not None:
+        with open(fname_baseline, 'r') as infile:
+            baseline = json.load(infile)
+        comparison = compare_results(results, baseline, args.threshold)
+        print_comparison(comparison, args.threshold)
+        # A regression fails the run, e.g. in continuous integration.
+        if any(is_flagged for *_, is_flagged in comparison):
+            sys.exit(1)
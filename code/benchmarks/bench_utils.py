@@ -0,0 +1,48 @@
+"""This file provides the helpers shared by the benchmarks that compare an implementation with
+an earlier one. Their inputs are built by the preparation itself from a synthetic extract, see
+synthetic_data.py.
+"""
+
+# %%
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_data import write_synthetic_data
+
+import setup_dct
+
+# %%
+# The synthetic extracts are kept here, so they are only generated once for each size. The path
+# is resolved on import, as the benchmarks change the working directory to the extract.
+SYNTHETIC_DIR = os.path.abspath('data/.cache/benchmarks')
+
+
+# %%
+def use_synthetic_data(num_agents, label=None):
+    """ This function changes the working directory to a synthetic extract for the number of
+    respondents, which is written on first use. The extract has the same layout as the root of
+    the repository.
+    """
+    if label is None:
+        label = 'synthetic-' + str(num_agents)
+
+    dirname = os.path.join(SYNTHETIC_DIR, label)
+    if not os.path.exists(os.path.join(dirname, 'data', 'all-variables.csv')):
+        write_synthetic_data(os.path.join(dirname, 'data'), num_agents)
+    os.chdir(dirname)
+
+    # The parsed sdf files are kept by their relative path, which now refers to another file.
+    setup_dct.CATALOGS.clear()
+
+
+# %%
+def time_function(func, *args):
+    """ This function returns the result and the wall time of a single call.
+    """
+    start = time.perf_counter()
+    rslt = func(*args)
+
+    return rslt, time.perf_counter() - start
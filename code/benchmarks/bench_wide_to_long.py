@@ -0,0 +1,59 @@
+"""This file compares the reshape-based transformation from the wide to the long format
+with the earlier label-based assignment, for synthetic extracts with the number of respondents
+in the NLSY79 and scale-ups. Run it from the root of the repository.
+"""
+
+# %%
+import pandas as pd
+import numpy as np
+
+from bench_utils import use_synthetic_data
+from bench_utils import time_function
+from synthetic_data import NUM_AGENTS
+
+from setup_classobj import wide_to_long
+from setup_classobj import SourceCls
+
+
+# %%
+def wide_to_long_loc(source_wide, additional_level, dct):
+    """ This is the earlier implementation, which assigns each variable and year separately.
+    """
+    caseid = [x + 1 for x in source_wide.index]
+    multi_index = pd.MultiIndex.from_product([caseid, additional_level], names=['Identifier', 'Survey Year'])
+    pd_long = pd.DataFrame(index=multi_index)
+
+    pd_long['IDENTIFIER'] = pd_long.index.get_level_values('Identifier')
+    pd_long['SURVEY_YEAR'] = pd_long.index.get_level_values('Survey Year')
+
+    for long_name in dct.keys():
+        pd_long[long_name] = np.nan
+        for year in additional_level:
+            if year not in dct[long_name].keys():
+                continue
+            pd_long.loc[(slice(None), year), long_name] = source_wide[dct[long_name][year]].values
+
+    for varname in ['IDENTIFIER', 'SURVEY_YEAR', 'RACE', 'GENDER']:
+        pd_long[varname] = pd_long[varname].astype('int64')
+
+    return pd_long
+
+
+# %%
+if __name__ == '__main__':
+
+    print('{:>12}{:>14}{:>14}{:>10}'.format('Respondents', 'Loop (s)', 'Reshape (s)', 'Speedup'))
+    for scale in [1, 2, 4]:
+        use_synthetic_data(NUM_AGENTS * scale)
+
+        source_obj = SourceCls()
+        source_obj.read_source()
+        source_wide, survey_years, dct = source_obj.source_wide, source_obj.survey_years, source_obj.dct
+
+        rslt_loop, time_loop = time_function(wide_to_long_loc, source_wide, survey_years, dct)
+        rslt_reshape, time_reshape = time_function(wide_to_long, source_wide, survey_years, dct)
+
+        pd.testing.assert_frame_equal(rslt_loop, rslt_reshape)
+
+        print('{:>12}{:>14.3f}{:>14.3f}{:>9.1f}x'.format(NUM_AGENTS * scale, time_loop, time_reshape,
+                                                       time_loop / time_reshape))
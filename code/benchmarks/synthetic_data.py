@@ -0,0 +1,383 @@
+"""This file writes a synthetic dataset with the structure of the NLSY79 extract, i.e. the sdf
+file, the wide csv file, the family income, and the continuous week crosswalk. The number of
+respondents, the survey rounds, and the number of additional columns are set by the user, so
+the preparation of the dataset can be tested at scale. The distributions follow the ones
+checked in SourceCls.testing(). Run it from the root of the repository, e.g.
+
+    python code/benchmarks/synthetic_data.py --num-agents 126860 --dirname synthetic/data
+
+and then run the preparation from the directory synthetic, which has the same layout as the
+root of the repository.
+"""
+
+# %%
+import argparse
+import sys
+import os
+
+import pandas as pd
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from setup_additional_vars import ASVAB_SECTIONS
+from setup_additional_vars import get_afqt_raw
+from setup_additional_vars import get_afqt_percentiles
+from setup_dct import rules_time_constant
+from setup_dct import rules_single_each_year
+from setup_dct import rules_highest_degree_received
+from setup_dct import WEEKS
+from setup_calendar import CALENDAR
+
+# %%
+# The number of respondents in the NLSY79.
+NUM_AGENTS = 12686
+
+# The respondents are written to the csv file in chunks of this size to bound memory use.
+CHUNKSIZE = 10000
+
+# The NLSY codes for missing values, i.e. refusal, don't know, invalid skip, valid skip, and
+# noninterview.
+MISSING_CODES = [-1, -2, -3, -4, -5]
+
+# The survey rounds in which a variable is available, if it's not available in all of them.
+ROUNDS = dict()
+ROUNDS['YEAR_OF_BIRTH'] = [1979, 1981]
+ROUNDS['MONTH_OF_BIRTH'] = [1979, 1981]
+ROUNDS['CPSOCC70'] = list(range(1979, 1994))
+ROUNDS['HIGHEST_DEGREE_RECEIVED'] = list(range(1988, 2013))
+ROUNDS['REASON_NONINTERVIEW'] = list(range(1980, 2013))
+for num in range(1, 6):
+    ROUNDS['CPS_JOB_INDICATOR_JOB_' + str(num)] = list(range(1980, 1993))
+    ROUNDS['OCCALL70_JOB_' + str(num)] = list(range(1979, 2001))
+
+# These variables are not part of the extract at all.
+MISSING_VARIABLES = ['HEALTH_INS', 'MAR_STATUS']
+
+# The highest degree received is asked twice in these rounds.
+ROUNDS_SECOND_DEGREE = list(range(2008, 2013))
+
+# The codes of the categorical variables and their frequencies, e.g. from the NLSY website.
+CODES = dict()
+CODES['RACE'] = ([1, 2, 3], [2002, 3174, 7510])
+CODES['GENDER'] = ([1, 2], [6403, 6283])
+CODES['SAMPLE_ID'] = (list(range(1, 21)), [2279, 2236, 1105, 1067, 901, 751, 742, 729, 609, 405,
+                                            346, 342, 226, 218, 203, 198, 162, 89, 53, 25])
+CODES['ASVAB_ALTERED_TESTING'] = ([51, 52, 53, 54, 67], [11625, 41, 127, 85, 36])
+CODES['YEAR_OF_BIRTH'] = (list(range(55, 66)), [1, 2, 1500, 1600, 1600, 1600, 1600, 1600, 1600, 1580, 2])
+CODES['HIGHEST_DEGREE_RECEIVED'] = (list(range(0, 9)), [442, 4025, 728, 976, 708, 394, 178, 49, 47])
+CODES['EMP_STATUS'] = ([0, 2, 3, 4, 5, 7], [4614, 38, 1, 321, 1464, 9])
+
+# The bins of the numeric variables, with the frequency of each bin.
+BINS = dict()
+BINS['OCCUPATION'] = ([(1, 195), (201, 245), (260, 285), (301, 395), (401, 575), (580, 590),
+                       (601, 715), (740, 785), (801, 802), (821, 824), (901, 965), (980, 984)],
+                      [1356, 966, 415, 1825, 1016, 1, 1274, 617, 14, 113, 1271, 122])
+BINS['EMP_HOURS'] = ([(0, 0), (1, 9), (10, 19), (20, 29), (30, 39), (40, 49), (50, 59), (60, 69),
+                      (70, 79), (80, 89), (90, 99), (100, 168)],
+                     [5697, 87, 194, 330, 762, 4009, 876, 379, 151, 74, 78, 10])
+BINS['WAGE_HOURLY'] = ([(0, 0), (1, 99), (100, 199), (200, 299), (300, 399), (400, 499), (500, 599),
+                        (600, 699), (700, 799), (800, 899), (900, 999), (1000, 5000)],
+                       [1, 26, 44, 41, 97, 323, 327, 262, 180, 182, 119, 647])
+
+# The share of interviewed respondents with a missing value, by variable.
+MISSING_SHARES = dict()
+MISSING_SHARES['CPSOCC70'] = 0.1
+MISSING_SHARES['OCCALL70_JOB'] = 0.6
+MISSING_SHARES['WAGE_HOURLY'] = 0.8
+MISSING_SHARES['HIGHEST_GRADE_ATTENDED'] = 0.9
+MISSING_SHARES['HIGHEST_DEGREE_RECEIVED'] = 0.3
+MISSING_SHARES['EMP_HOURS'] = 0.004
+MISSING_SHARES['ASVAB'] = 0.06
+MISSING_SHARES['OTHER'] = 0.05
+
+
+# %%
+def write_synthetic_data(dirname, num_agents=NUM_AGENTS, rounds=None, num_extra=0, seed=123):
+    """ Write the synthetic dataset to the directory dirname. The extract has variables for the
+    listed survey rounds, all by default, and the given number of additional columns that are
+    not part of the panel.
+    """
+    if rounds is None:
+        rounds = CALENDAR.rounds
+
+    os.makedirs(dirname, exist_ok=True)
+
+    crosswalk = get_synthetic_crosswalk(CALENDAR.base_year, max(rounds))
+    crosswalk.to_pickle(os.path.join(dirname, 'continuous_week_crosswalk_2012.pkl'))
+
+    variables = get_synthetic_variables(crosswalk, rounds, num_extra)
+    write_sdf(variables, os.path.join(dirname, 'all-variables.sdf'))
+
+    # The respondents are independent, so each chunk is drawn separately with its own stream of
+    # random numbers. The last stream is used for the family income.
+    starts = range(0, num_agents, CHUNKSIZE)
+    streams = np.random.SeedSequence(seed).spawn(len(starts) + 1)
+
+    fname = os.path.join(dirname, 'all-variables.csv')
+    for num, start in enumerate(starts):
+        caseid = np.arange(start + 1, min(start + CHUNKSIZE, num_agents) + 1)
+        source_wide = get_synthetic_wide(variables, caseid, np.random.default_rng(streams[num]))
+        source_wide.to_csv(fname, mode='w' if num == 0 else 'a', header=(num == 0), index=False)
+
+    tnfi_79 = get_synthetic_family_income(num_agents, np.random.default_rng(streams[-1]))
+    tnfi_79.to_csv(os.path.join(dirname, 'TNFI_TRUNC_79.csv'), index=False)
+
+
+# %%
+def get_synthetic_crosswalk(first_year, last_year):
+    """ This function returns the crosswalk between continuous weeks and calendar years. The
+    first week starts on January 1 of the first year.
+    """
+    starts = pd.date_range(str(first_year) + '-01-01', str(last_year) + '-12-31', freq='7D')
+
+    crosswalk = pd.DataFrame()
+    crosswalk['Week Start:\nMonth'] = starts.month
+    crosswalk['Week Start: \nDay'] = starts.day
+    crosswalk['Week Start: \nYear'] = starts.year
+    crosswalk['Calendar Year \nWeek Number '] = crosswalk.groupby('Week Start: \nYear').cumcount() + 1
+    crosswalk['Continuous \nWeek Number'] = np.arange(1, len(starts) + 1)
+
+    return crosswalk
+
+
+# %%
+def get_synthetic_variables(crosswalk, rounds, num_extra):
+    """ This function returns the variables in the extract as (reference number, year,
+    description, label), where the descriptions are constructed to match the rules in setup_dct.
+    The label determines the distribution of the values.
+    """
+    infos = []
+    for rule in rules_time_constant(rounds):
+        # The items of the ROSENBERG scale are identified by their reference number.
+        if rule.label.startswith('ROSENBERG_') and rule.label != 'ROSENBERG_SCORE':
+            infos += [(rule.substrings[0], 1980, rule.label + ' ITEM', rule.label)]
+        else:
+            infos += [(None, 1979, rule.substrings[0], rule.label)]
+
+    # The first rule for each variable is sufficient to match all of its years.
+    labels = []
+    for rule in rules_single_each_year() + rules_highest_degree_received():
+        if rule.label in labels + MISSING_VARIABLES:
+            continue
+        labels += [rule.label]
+        for year in rounds:
+            if year not in ROUNDS.get(rule.label, rounds):
+                continue
+            infos += [(None, year, ', '.join(rule.substrings), rule.label)]
+            if rule.label == 'HIGHEST_DEGREE_RECEIVED' and year in ROUNDS_SECOND_DEGREE:
+                infos += [(None, year, ', '.join(rule.substrings) + ' (2ND)', rule.label)]
+
+    # The weekly information is described by the continuous week, only the weeks of the
+    # year that enter the panel are part of the extract.
+    cond = crosswalk['Calendar Year \nWeek Number '].isin(WEEKS)
+    for _, row in crosswalk[cond].iterrows():
+        year, week = row['Week Start: \nYear'], row['Continuous \nWeek Number']
+        infos += [(None, year, 'LABOR FORCE STATUS WEEK ' + str(week), 'EMP_STATUS')]
+        infos += [(None, year, 'HOURS AT ALL JOBS WEEK ' + str(week), 'EMP_HOURS')]
+
+    for num in range(num_extra):
+        infos += [(None, rounds[num % len(rounds)], 'ADDITIONAL VARIABLE ' + str(num), 'OTHER')]
+
+    # All other reference numbers are outside of the range used for the ROSENBERG scale.
+    variables, count = [], 0
+    for name, year, description, label in infos:
+        if name is None:
+            name, count = 'R{:05d}.{:02d}'.format(10000 + count // 100, count % 100), count + 1
+        variables += [(name, int(year), description, label)]
+
+    return variables
+
+
+# %%
+def write_sdf(variables, fname):
+    """ Write the sdf file, which lists each variable with its reference number, year, and
+    description.
+    """
+    lines = ['', '', 'Reference', 'Number     Year    Variable Description' + ' ' * 54 + 'Question Name', '-' * 120]
+    for num, (name, year, description, _) in enumerate(variables):
+        lines += ['{:<11}{:<8}{:<74}Q{:05d}'.format(name, year, description, num)]
+
+    with open(fname, 'w') as outfile:
+        outfile.write('\n'.join(lines) + '\n')
+
+
+# %%
+def get_synthetic_wide(variables, caseid, rng):
+    """ This function returns the wide dataset for the respondents in caseid, with a column for
+    each variable named by its reference number.
+    """
+    num_agents = len(caseid)
+
+    # The share of respondents interviewed declines over time, all are interviewed in 1979.
+    years = sorted(set(year for _, year, _, _ in variables))
+    interviewed = dict()
+    for year in years:
+        share = 1.0 if year <= 1979 else 0.96 - 0.011 * (year - 1980)
+        interviewed[year] = rng.uniform(size=num_agents) < share
+
+    columns = dict()
+    respondent = get_synthetic_respondents(num_agents, rng)
+
+    for name, year, _, label in variables:
+        column_name = name.replace('.', '')
+        if label == 'IDENTIFIER':
+            values = caseid
+        elif label in respondent.keys():
+            values = respondent[label]
+        elif label in ['YEAR_OF_BIRTH', 'MONTH_OF_BIRTH']:
+            values = respondent[label + '_' + str(year)]
+        elif label == 'REASON_NONINTERVIEW':
+            values = np.where(interviewed[year], -4, rng.integers(60, 68, size=num_agents))
+        elif label in ['EMP_STATUS', 'EMP_HOURS']:
+            # Weekly information is reconstructed from the employment histories, so it is
+            # available for all respondents.
+            values = draw_values(label, year, num_agents, rng)
+        else:
+            values = np.where(interviewed[year], draw_values(label, year, num_agents, rng), -5)
+        columns[column_name] = values
+
+    return pd.DataFrame(columns)
+
+
+# %%
+def get_synthetic_respondents(num_agents, rng):
+    """ This function returns the values of the variables that do not vary over time. The
+    AFQT percentile is consistent with the ASVAB scores.
+    """
+    rslt = dict()
+    for label in ['RACE', 'GENDER', 'SAMPLE_ID', 'ASVAB_ALTERED_TESTING']:
+        rslt[label] = draw_codes(*CODES[label], num_agents, rng)
+
+    for label in ['HIGHEST_GRADE_COMPLETED_FATHER', 'HIGHEST_GRADE_COMPLETED_MOTHER']:
+        rslt[label] = with_missing(rng.integers(0, 21, size=num_agents), 0.1, rng)
+
+    rslt['ROTTER_SCORE'] = with_missing(rng.integers(4, 17, size=num_agents), 0.05, rng)
+    rslt['ROSENBERG_SCORE'] = with_missing(rng.integers(6, 31, size=num_agents), 0.05, rng)
+    for num in range(1, 11):
+        if num < 5:
+            rslt['ROTTER_' + str(num)] = with_missing(rng.integers(1, 3, size=num_agents), 0.05, rng)
+        rslt['ROSENBERG_' + str(num)] = with_missing(rng.integers(1, 5, size=num_agents), 0.05, rng)
+
+    # The ASVAB is missing for a share of the respondents, and so is the AFQT percentile.
+    is_tested = rng.uniform(size=num_agents) > MISSING_SHARES['ASVAB']
+    sections = dict()
+    sections['ASVAB_ARITHMETIC_REASONING'] = rng.binomial(30, 0.55, size=num_agents)
+    sections['ASVAB_WORD_KNOWLEDGE'] = rng.binomial(35, 0.7, size=num_agents)
+    sections['ASVAB_PARAGRAPH_COMPREHENSION'] = rng.binomial(15, 0.65, size=num_agents)
+    sections['ASVAB_NUMERICAL_OPERATIONS'] = rng.binomial(50, 0.7, size=num_agents)
+
+    afqt_raw = get_afqt_raw(*[sections[label].astype('float64') for label in ASVAB_SECTIONS])
+
+    afqt_1 = get_afqt_percentiles(afqt_raw).astype('int64')
+
+    # The AFQT percentile is not reported if the testing procedure was altered.
+    is_reported = is_tested & (rslt['ASVAB_ALTERED_TESTING'] != 67)
+    rslt['AFQT_1'] = np.where(is_reported, afqt_1, -4)
+    for label in sections.keys():
+        rslt[label] = np.where(is_tested, sections[label], -4)
+
+    # The birth information is collected in 1979 and again in 1981, unless the respondent
+    # is not interviewed.
+    rslt['YEAR_OF_BIRTH_1979'] = draw_codes(*CODES['YEAR_OF_BIRTH'], num_agents, rng)
+    rslt['MONTH_OF_BIRTH_1979'] = rng.integers(1, 13, size=num_agents)
+    for label in ['YEAR_OF_BIRTH', 'MONTH_OF_BIRTH']:
+        rslt[label + '_1981'] = with_missing(rslt[label + '_1979'], 0.05, rng, code=-5)
+
+    return rslt
+
+
+# %%
+def draw_values(label, year, size, rng):
+    """ This function returns the values of a variable in a year, including missing values
+    among the interviewed respondents.
+    """
+    if label == 'EMP_STATUS':
+        # Codes of at least 100 refer to a job, which is identified by the year and its number.
+        values = draw_codes(*CODES['EMP_STATUS'], size, rng)
+        is_working = rng.uniform(size=size) < 0.5
+        return np.where(is_working, year * 100 + rng.integers(1, 6, size=size), values)
+    elif label == 'EMP_HOURS':
+        return with_missing(draw_bins(*BINS['EMP_HOURS'], size, rng), MISSING_SHARES['EMP_HOURS'], rng)
+    elif label in ['CPSOCC70'] or label.startswith('OCCALL70_JOB'):
+        share = MISSING_SHARES['CPSOCC70' if label == 'CPSOCC70' else 'OCCALL70_JOB']
+        return with_missing(draw_bins(*BINS['OCCUPATION'], size, rng), share, rng)
+    elif label.startswith('WAGE_HOURLY_JOB'):
+        return with_missing(draw_bins(*BINS['WAGE_HOURLY'], size, rng), MISSING_SHARES['WAGE_HOURLY'], rng)
+    elif label.startswith('CPS_JOB_INDICATOR_JOB'):
+        return with_missing(rng.integers(0, 2, size=size), 0.5, rng)
+    elif label == 'HIGHEST_DEGREE_RECEIVED':
+        values = draw_codes(*CODES['HIGHEST_DEGREE_RECEIVED'], size, rng)
+        return with_missing(values, MISSING_SHARES['HIGHEST_DEGREE_RECEIVED'], rng)
+    elif label == 'HIGHEST_GRADE_ATTENDED':
+        values = np.where(rng.uniform(size=size) < 0.01, 95, rng.integers(1, 21, size=size))
+        return with_missing(values, MISSING_SHARES['HIGHEST_GRADE_ATTENDED'], rng)
+    elif label == 'HIGHEST_GRADE_COMPLETED':
+        return with_missing(rng.integers(0, 21, size=size), MISSING_SHARES['OTHER'], rng)
+    elif label == 'INCOME_WAGES_SALARY':
+        return with_missing(rng.integers(0, 100001, size=size), 0.2, rng)
+    elif label == 'REGION':
+        return with_missing(rng.integers(1, 5, size=size), MISSING_SHARES['OTHER'], rng)
+    else:
+        return with_missing(rng.integers(0, 2, size=size), MISSING_SHARES['OTHER'], rng)
+
+
+# %%
+def draw_codes(codes, counts, size, rng):
+    """ This function draws the codes with probabilities proportional to their counts.
+    """
+    return rng.choice(codes, size=size, p=np.array(counts) / np.sum(counts))
+
+
+# %%
+def draw_bins(bins, counts, size, rng):
+    """ This function draws a bin with probability proportional to its count and then a value
+    within the bin, with both bounds included.
+    """
+    lower, upper = np.array(bins).T
+    idx = draw_codes(range(len(bins)), counts, size, rng)
+
+    return rng.integers(lower[idx], upper[idx] + 1)
+
+
+# %%
+def with_missing(values, share, rng, code=None):
+    """ This function replaces a share of the values with a code for a missing value, drawn
+    from all codes unless specified.
+    """
+    cond = rng.uniform(size=len(values)) < share
+    if code is None:
+        code = rng.choice(MISSING_CODES[:-1], size=len(values))
+
+    return np.where(cond, code, values)
+
+
+# %%
+def get_synthetic_family_income(num_agents, rng):
+    """ This function returns the total net family income in 1978, truncated at 75,001 and
+    missing for about a fifth of the respondents.
+    """
+    tnfi_79 = pd.DataFrame()
+    tnfi_79['IDENTIFIER'] = np.arange(1, num_agents + 1)
+
+    values = np.minimum(rng.lognormal(np.log(8000), 1.0, size=num_agents).round(), 75001)
+    tnfi_79['TNFI_TRUNC'] = with_missing(values.astype('int64'), 0.2, rng)
+
+    return tnfi_79
+
+
+# %%
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Write a synthetic dataset like the NLSY79 extract.')
+    parser.add_argument('--dirname', default='synthetic/data', help='output directory')
+    parser.add_argument('--num-agents', type=int, default=NUM_AGENTS, help='number of respondents')
+    parser.add_argument('--num-extra', type=int, default=0, help='number of additional columns')
+    parser.add_argument('--last-round', type=int, default=CALENDAR.rounds[-1],
+                        help='last survey round in the extract')
+    parser.add_argument('--seed', type=int, default=123, help='seed of the random number generator')
+    args = parser.parse_args()
+
+    rounds = [year for year in CALENDAR.rounds if year <= args.last_round]
+
+    write_synthetic_data(args.dirname, args.num_agents, rounds, args.num_extra, args.seed)
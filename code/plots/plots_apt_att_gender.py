@@ -13,9 +13,13 @@ from setup_fin_dataset import get_dataset
 # change working directory to a separate folder for plots
 os.chdir('out/heatmaps')
 
+# %%
+# Only the variables used in the plots are read from the dataset.
+varnames = ['GENDER', 'AGE', 'AFQT_1', 'ROSENBERG_SCORE', 'ROTTER_SCORE', 'WAGE_HOURLY_JOB_1']
+
 # %%
 # Pull in the data
-df = get_dataset()
+df = get_dataset(varnames)
 
 '''First examine the basic relationship between aptitude / attitude scores
 and hourly wages in later life for males
@@ -66,7 +70,7 @@ for parent in ['AFQT', 'ROSENBERG', 'ROTTER']:
 '''Next examine these relationships for females
 '''
 # %%
-df = get_dataset()
+df = get_dataset(varnames)
 
 # %%
 # Filter for females
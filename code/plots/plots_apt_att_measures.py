@@ -11,9 +11,13 @@ import numpy as np
 
 from setup_fin_dataset import get_dataset
 
+# %%
+# Only the variables used in the plots are read from the dataset.
+varnames = ['AGE', 'AFQT_1', 'ROSENBERG_SCORE', 'ROTTER_SCORE', 'WAGE_HOURLY_JOB_1']
+
 # %%
 # Pull in the data
-df = get_dataset()
+df = get_dataset(varnames)
 df.columns 
 
 # %%
@@ -61,7 +65,7 @@ for parent in ['AFQT', 'ROSENBERG', 'ROTTER']:
 
 # %%
 # Re-examine the relationship at a later age
-df = get_dataset()
+df = get_dataset(varnames)
 
 cond = df['AGE'].isin([47])
 df = df[cond]
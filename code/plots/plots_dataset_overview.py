@@ -7,8 +7,8 @@ import numpy as np
 import matplotlib
 from mpl_toolkits.axisartist.axislines import Subplot
 
-from setup_fin_dataset import SURVEY_YEARS
 from setup_fin_dataset import get_dataset
+from setup_calendar import CALENDAR
 
 
 # %%
@@ -21,7 +21,12 @@ def set_formatter(ax):
     ax.spines['right'].set_visible(False)
 
 # %%
-df = get_dataset()
+# Only the variables used in the plots are read from the dataset.
+varnames = ['IDENTIFIER', 'SURVEY_YEAR', 'YEAR_OF_BIRTH', 'IS_INTERVIEWED', 'SAMPLE_ID',
+            'TNFI_TRUNC', 'FAMILY_INCOME_QUARTILE']
+
+# %%
+df = get_dataset(varnames)
 df
 
 # %%
@@ -47,16 +52,17 @@ plt.savefig('fig1-dataset-basic-birth.png')
 
 
 # %%
-# Plot the number of observations over time.
+# Plot the number of observations over time. Nobody is interviewed in the years between 
+# survey rounds, so these are not part of the panel.
 num_obs = []
-for year in SURVEY_YEARS:
+for year in CALENDAR.panel_years:
     cond = df.loc[df['SURVEY_YEAR'] == year, 'IS_INTERVIEWED'].isin([True])
     num_obs += [df.loc[df['SURVEY_YEAR'] == year, 'IDENTIFIER'][cond].count()]
 
 ax = plt.figure().add_subplot(111)
 set_formatter(ax)
 
-ax.bar(df['SURVEY_YEAR'].unique(), num_obs)
+ax.bar(CALENDAR.panel_years, num_obs)
 
 csfont = {'fontname':'Times New Roman'}
 
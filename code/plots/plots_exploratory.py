@@ -26,10 +26,15 @@ print(code_folder)
 
 
 
+# %%
+# Only the variables used in the plots are read from the dataset.
+varnames = ['IDENTIFIER', 'SURVEY_YEAR', 'GENDER', 'RACE', 'AFQT_1', 'ROSENBERG_SCORE',
+            'ROTTER_SCORE', 'FAMILY_INCOME_QUARTILE', 'MOTHER_EDU', 'FATHER_EDU']
+
 # %%
 '''Plot scores by income quartile
 '''
-df = get_dataset()
+df = get_dataset(varnames)
 
 #%%
 df.dropna(axis=0, how='any', subset=['AFQT_1','ROSENBERG_SCORE', 'ROTTER_SCORE'], inplace=True)
@@ -77,7 +82,7 @@ for score in ['ROTTER', 'ROSENBERG']:
 # %%
 '''Plot scores by gender
 '''
-df = get_dataset()
+df = get_dataset(varnames)
 
 #%%
 df.dropna(axis=0, how='any', subset=['AFQT_1','ROSENBERG_SCORE', 'ROTTER_SCORE'], inplace=True)
@@ -124,7 +129,7 @@ for score in ['ROTTER', 'ROSENBERG']:
 # %%
 '''Plot scores by race
 '''
-df = get_dataset()
+df = get_dataset(varnames)
 
 #%%
 df.dropna(axis=0, how='any', subset=['AFQT_1','ROSENBERG_SCORE', 'ROTTER_SCORE'], inplace=True)
@@ -172,7 +177,7 @@ for score in ['ROTTER', 'ROSENBERG']:
 # %%
 '''Plot by parental educational attainment, mother
 '''
-df = get_dataset()
+df = get_dataset(varnames)
 
 #%%
 df.dropna(axis=0, how='any', subset=['AFQT_1','ROSENBERG_SCORE', 'ROTTER_SCORE'], inplace=True)
@@ -236,7 +241,7 @@ for score in ['ROTTER', 'ROSENBERG']:
 '''Plot by parental educational attainment, father
 '''
 # %%
-df = get_dataset()
+df = get_dataset(varnames)
 
 #%%
 df.dropna(axis=0, how='any', subset=['AFQT_1','ROSENBERG_SCORE', 'ROTTER_SCORE'], inplace=True)
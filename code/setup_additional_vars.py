@@ -2,71 +2,106 @@
 """
 
 # %%
+import pandas as pd
 import numpy as np
 from numpy.testing import assert_equal
 
+from setup_calendar import CALENDAR
+from setup_profiling import profiled
 
 # %%
+# The adjustment of the Numerical Operations score, see NLSY Attachment 106. Scores not listed
+# remain unchanged.
+NUMERICAL_ADJUSTMENT = {0: 0, 1: 0, 2: 1, 3: 2, 7: 8, 8: 9, 9: 10, 10: 11, 11: 12, 12: 14, 13: 15, 
+    14: 16, 15: 17, 16: 18, 17: 19, 18: 21, 19: 22, 20: 23, 21: 24, 22: 25, 23: 26, 24: 27, 25: 28,
+    26: 29, 27: 30, 28: 31, 29: 33, 30: 34, 31: 35, 32: 36, 33: 37, 34: 38, 35: 39, 36: 39,
+    37: 40, 38: 41, 39: 42, 40: 43, 41: 44, 42: 45, 43: 46, 44: 47, 45: 48, 46: 49, 47: 49,
+    48: 50, 49: 50, 50: 50}
+
+# The same adjustment as a lookup table indexed by the score.
+NUMERICAL_ADJUSTMENT_TABLE = np.arange(51, dtype='float64')
+NUMERICAL_ADJUSTMENT_TABLE[list(NUMERICAL_ADJUSTMENT.keys())] = list(NUMERICAL_ADJUSTMENT.values())
+
+# The job slots with employer-specific information in each survey round.
+JOBS = [1, 2, 3, 4, 5]
+
+# The sections of the ASVAB that enter the AFQT score, with the Numerical Operations score last.
+ASVAB_SECTIONS = ['ASVAB_ARITHMETIC_REASONING', 'ASVAB_WORD_KNOWLEDGE', 'ASVAB_PARAGRAPH_COMPREHENSION',
+                  'ASVAB_NUMERICAL_OPERATIONS']
+
+
+# %%
+@profiled
 def create_is_interviewed(df):
     """This function creates an indicator for whether an individual was interviewed
     that year based on recorded reasons for non-interviews. 
     """
     df['IS_INTERVIEWED'] = df['REASON_NONINTERVIEW'].fillna(0) == 0
 
-    for year in [1995, 1997, 1999, 2001, 2003, 2005, 2007, 2009, 2011]:
-        df.loc[(slice(None), year), 'IS_INTERVIEWED'] = False
+    # Nobody is interviewed in the years between survey rounds.
+    cond = CALENDAR.is_off_year(df.index.get_level_values('Survey Year'))
+    df.loc[cond, 'IS_INTERVIEWED'] = False
 
     return df
 
 # %%
-def standarize_employer_information(df):
+def get_job_block(df, start, jobs=JOBS):
+    """ This function returns the variables of all job slots as an array with one row for each
+    record and one column for each job.
+    """
+    return df[[start + str(job) for job in jobs]].to_numpy(dtype='float64', na_value=np.nan)
+
+# %%
+@profiled
+def standarize_employer_information(df, jobs=JOBS, census='70'):
     """ This function creates a new variable for employer-specific information 
     on an occupation using the CPS70 codes. See additional information at:
     https://www.nlsinfo.org/content/cohorts/nlsy79/topical-guide/employment/jobs-employers
     """
-    for i in range(1, 6):
-        df['OCCALL70_MOD_JOB_' + str(i)] = df['OCCALL70_JOB_' + str(i)]
+    occall = get_job_block(df, 'OCCALL{}_JOB_'.format(census), jobs)
+    is_cps = get_job_block(df, 'CPS_JOB_INDICATOR_JOB_', jobs) == 1
 
     # Information on job 1 is missing in 1979 and 1993 (it is identical with CPSOCC70).
-    for year in [1979, 1993]:
-        cond = df['SURVEY_YEAR'] == year
-        df.loc[cond, 'OCCALL70_MOD_JOB_1'] = df.loc[cond, 'CPSOCC70']
+    is_cps[:, jobs.index(1)] |= df['SURVEY_YEAR'].isin([1979, 1993]).to_numpy()
 
     # Between 1980 - 1992 there is an indicator variable that maps the CPSOCC70 information
     # to the OCCALL70 variable. NOTE: two open questions ignored here: (1) There are two 
     # variables in 1990 ``INT CHECK - IS JOB #01 SAME AS CURRENT JOB?'' (R3340000, R3342400) 
     # but the values don't match in every instance. (2) There are a few cases where
-    # the CPSOCC indicator takes a value of one for more than 1 of the 5 OCCALL70 variables. 
-    for i in range(1, 6):
-        cond = (df['CPS_JOB_INDICATOR_JOB_' + str(i)] == 1)
-        df.loc[cond, 'OCCALL70_MOD_JOB_' + str(i)] = df.loc[cond, 'CPSOCC70']
+    # the CPSOCC indicator takes a value of one for more than 1 of the 5 OCCALL70 variables,
+    # see get_employer_conflicts().
+    cpsocc = df['CPSOCC{}'.format(census)].to_numpy(dtype='float64', na_value=np.nan)
+    occall_mod = np.where(is_cps, cpsocc[:, None], occall)
+
+    for pos, job in enumerate(jobs):
+        df['OCCALL{}_MOD_JOB_{}'.format(census, job)] = occall_mod[:, pos]
 
     return df
 
 # %%
+def get_employer_conflicts(df, jobs=JOBS):
+    """ This function returns the records where the CPSOCC indicator takes a value of one for
+    more than one job, along with the indicator for each job.
+    """
+    is_cps = get_job_block(df, 'CPS_JOB_INDICATOR_JOB_', jobs) == 1
+    is_conflict = is_cps.sum(axis=1) > 1
+
+    return pd.DataFrame(is_cps[is_conflict], index=df.index[is_conflict], columns=jobs)
+
+# %%
+@profiled
 def calculate_afqt_scores(df):
     """This function calculates the Aptitude, Achievement, and Intelligence (AFQT) scores, 
     with the Numerical Operations score adjusted along the lines described in NLSY Attachment 106. 
     For more details, see: 
     https://www.nlsinfo.org/content/cohorts/nlsy79/topical-guide/education/aptitude-achievement-intelligence-scores
     """
-    df['NUMERICAL_ADJ'] = df['ASVAB_NUMERICAL_OPERATIONS']
-
-    adjust_no = {0: 0, 1: 0, 2: 1, 3: 2, 7: 8, 8: 9, 9: 10, 10: 11, 11: 12, 12: 14, 13: 15, 14: 16,
-        15: 17, 16: 18, 17: 19, 18: 21, 19: 22, 20: 23, 21: 24, 22: 25, 23: 26, 24: 27, 25: 28,
-        26: 29, 27: 30, 28: 31, 29: 33, 30: 34, 31: 35, 32: 36, 33: 37, 34: 38, 35: 39, 36: 39,
-        37: 40, 38: 41, 39: 42, 40: 43, 41: 44, 42: 45, 43: 46, 44: 47, 45: 48, 46: 49, 47: 49,
-        48: 50, 49: 50, 50: 50}
+    # The ASVAB scores don't vary over time, so the score is computed once for each respondent.
+    varnames = ASVAB_SECTIONS + ['ASVAB_ALTERED_TESTING', 'AFQT_1']
+    asvab = df[varnames].groupby(level='Identifier', sort=False).first()
 
-    df['NUMERICAL_ADJ'].replace(adjust_no, inplace=True)
-
-    df['AFQT_RAW'] = 0.00
-    df['AFQT_RAW'] += df['ASVAB_ARITHMETIC_REASONING']
-    df['AFQT_RAW'] += df['ASVAB_WORD_KNOWLEDGE']
-    df['AFQT_RAW'] += df['ASVAB_PARAGRAPH_COMPREHENSION']
-    df['AFQT_RAW'] += 0.5 * df['NUMERICAL_ADJ']
-
-    del df['NUMERICAL_ADJ']
+    afqt_raw = get_afqt_raw(*[asvab[varname].to_numpy(dtype='float64', na_value=np.nan)
+                              for varname in ASVAB_SECTIONS])
 
     # There are a couple of variables for which AFQT_RAW can be computed where there is no AFQT_1
     # available. The variable AFQT_1 is recorded as NAN by NLSY if the variable for the test procedure 
@@ -81,72 +116,184 @@ def calculate_afqt_scores(df):
     #          85   54      COMP-SPANISH INSTR. CARDS
     #          36   67      COMP-PRODECURES ALTERED
     #
-    cond = df['ASVAB_ALTERED_TESTING'].isin([67])
-    df.loc[cond, 'AFQT_RAW'] = np.nan
+    afqt_raw[asvab['ASVAB_ALTERED_TESTING'].to_numpy(dtype='float64', na_value=np.nan) == 67] = np.nan
 
     # Test; reconstruct the AFQT_1 variable from the inputs.
-    assert_equal(_test_afqt(df), True)
+    assert_equal(_test_afqt(afqt_raw, asvab['AFQT_1'].to_numpy(dtype='float64', na_value=np.nan)), True)
+
+    # Broadcast the score to all years.
+    afqt_raw = pd.Series(afqt_raw, index=asvab.index)
+    df['AFQT_RAW'] = afqt_raw.reindex(df.index.get_level_values('Identifier')).to_numpy()
 
     return df
 
 # %%
+def get_afqt_raw(arithmetic, word, paragraph, numerical):
+    """ This function returns the raw AFQT score from the scores of the ASVAB sections, given
+    as float arrays with NaN for missing scores. The Numerical Operations score is adjusted
+    by a lookup in the table and enters with a weight of one half.
+    """
+    # Only whole scores in the range of the table are adjusted, any other score, including a
+    # missing one, remains unchanged as for the scores not listed in the adjustment.
+    is_listed = (numerical >= 0) & (numerical < len(NUMERICAL_ADJUSTMENT_TABLE))
+    is_listed &= (numerical == np.floor(numerical))
+
+    idx = np.where(is_listed, numerical, 0).astype('intp')
+    numerical_adj = np.where(is_listed, NUMERICAL_ADJUSTMENT_TABLE[idx], numerical)
+
+    afqt_raw = arithmetic + word
+    afqt_raw += paragraph
+    afqt_raw += 0.5 * numerical_adj
+
+    return afqt_raw
+
+# %%
+@profiled
 def aggregate_birth_information(df):
     """ This function aggregates age information that was collected in 1979 and 1981. See
     https://www.nlsinfo.org/content/cohorts/nlsy79/topical-guide/household/age for more details
     """
-    def _construct_birth_info(agent):
-        """ Construct the correct birth variable for each respondent.
-        """
-        # Store the original information for now for debugging and testing purposes.
-        for substring in ['YEAR_OF_BIRTH', 'MONTH_OF_BIRTH']:
-            for year in [1979, 1981]:
-                agent[substring + '_' + str(year)] = agent[substring][:, year].values[0]
-            # Use information from 1981 unless unavailable.
-            agent[substring] = np.nan
-            agent[substring] = agent[substring + '_1981']
-            if agent[substring].isnull().values.any():
-                agent[substring] = agent[substring + '_1979']
-
-        return agent
-
-    df = df.groupby('IDENTIFIER').apply(_construct_birth_info)
+    # Construct the correct birth variables at the level of the respondent.
+    birth_info = pd.DataFrame(index=df.index.unique(level='Identifier'))
+    for substring in ['YEAR_OF_BIRTH', 'MONTH_OF_BIRTH']:
+        # Store the original information for now for testing purposes.
+        for year in [1979, 1981]:
+            birth_info[substring + '_' + str(year)] = df[substring].xs(year, level='Survey Year')
+        # Use information from 1981 unless unavailable.
+        birth_info[substring] = birth_info[substring + '_1981'].fillna(birth_info[substring + '_1979'])
 
     # Apply some basic tests to confirm that the computation was correct.
     for substring in ['YEAR_OF_BIRTH', 'MONTH_OF_BIRTH']:
         # There can't be any missing values in the birth variables.
-        assert not df[substring].isnull().any()
+        assert not birth_info[substring].isnull().any()
         # Columns should be identical when the values for 1981 are not null.
         # Otherwise they should be identical to 1979.
-        cond = (df[substring + '_1981'].notnull())
-        assert df.loc[cond, substring].equals(df.loc[cond, substring + '_1981'])
-        assert df.loc[~cond, substring].equals(df.loc[~cond, substring + '_1979'])
+        cond = (birth_info[substring + '_1981'].notnull())
+        assert birth_info.loc[cond, substring].equals(birth_info.loc[cond, substring + '_1981'])
+        assert birth_info.loc[~cond, substring].equals(birth_info.loc[~cond, substring + '_1979'])
 
-    # Delete the other variables for birth month/year, now not needed.
-    for substring in ['YEAR_OF_BIRTH', 'MONTH_OF_BIRTH']:
-        for year in [1979, 1981]:
-            del df[substring + '_' + str(year)]
+    birth_info['YEAR_OF_BIRTH'] += 1900
 
-    df['YEAR_OF_BIRTH'] += 1900
+    # Broadcast the information to all years in a single join, keeping the order of columns.
+    columns = df.columns
+    df = df.drop(columns=['YEAR_OF_BIRTH', 'MONTH_OF_BIRTH'])
+    df = df.join(birth_info[['YEAR_OF_BIRTH', 'MONTH_OF_BIRTH']], on='Identifier')
+
+    return df[columns]
+
+# %%
+@profiled
+def merge_family_income(df, tnfi_79):
+    """ This function merges the total net family income, which refers to 1978, to the panel.
+    """
+    tnfi_79 = tnfi_79.copy()
+    tnfi_79['SURVEY_YEAR'] = 1978
+
+    return pd.merge(df, tnfi_79, how='left', left_on=['IDENTIFIER', 'SURVEY_YEAR'],
+                    right_on=['IDENTIFIER', 'SURVEY_YEAR'])
+
+# %%
+@profiled
+def create_categories(df):
+    """ This function creates the age and the categorical variables for family income and
+    education used across the plots and analysis.
+    """
+    df = create_age(df)
+    df = create_family_income_quartile(df)
+    df = create_edu_category(df)
+    df = create_parent_edu(df)
 
     return df
 
 # %%
-def _test_afqt(df):
-    """ NLSY provides percentile information for AFQT scores, reconstructed here 
-    as a check based on NLSY instructions.
+@profiled
+def create_age(df):
+    """ This function adds a crude measure for a respondent's age, crude because month of the
+    interview may not directly align with month of birth.
     """
-    df_internal = df.copy(deep=True)
+    df['AGE'] = df['SURVEY_YEAR'] - df['YEAR_OF_BIRTH']
 
-    # Adjust for missing values here, even though this is also done later in the code
-    # for all variables.
-    for label in ['AFQT_RAW', 'AFQT_1']:
-        cond = (df_internal[label] < 0)
-        df_internal.loc[cond, label] = np.nan
+    return df
 
-    # Match ``AFQT_RAW`` to percentile of distribution
-    cond = df_internal['AFQT_RAW'] <= 23.5
-    df_internal.loc[cond, 'AFQT_PERCENTILES'] = 1
+# %%
+@profiled
+def create_family_income_quartile(df):
+    """ This function constructs the family income quartile variable.
+    """
+    trunc_data = df.loc[df['SURVEY_YEAR'] == 1978, ['TNFI_TRUNC']]
+
+    first_q, second_q, third_q = get_income_quartile_cutoffs(trunc_data)
+
+    df['FAMILY_INCOME_QUARTILE'] = np.nan
+
+    def func(x):
+        if 'NaN' != x < first_q:
+            return 'first quartile'
+        elif first_q <= x < second_q:
+            return 'second quartile'
+        elif second_q <= x < third_q:
+            return 'third quartile'
+        elif third_q <= x != 'NaN':
+            return 'fourth quartile'
+
+    df['FAMILY_INCOME_QUARTILE'] = df['TNFI_TRUNC'].apply(func)
+
+    return df
+
+# %%
+@profiled
+def create_edu_category(df):
+    """ This function constructs the categorical education variable.
+    """
+    def func(y):
+        if y < 1:
+            return 'less than hs'
+        elif y == 1:
+            return 'hs'
+        elif y == 2:
+            return 'assoc'
+        elif 3 <= y <= 4:
+            return 'college'
+        elif 5 <= y <= 7:
+            return 'beyond'
+
+    # The nullable integer codes are converted to floats, so missing values are NaN below.
+    df['EDU_CATEGORY'] = df['HIGHEST_DEGREE_RECEIVED'].astype('float64').apply(func)
+
+    return df
+
+# %%
+@profiled
+def create_parent_edu(df):
+    """ This function constructs the categorical parental education variables.
+    """
+    def func(z):
+        if z <= 11:
+            return 'Less than HS'
+        elif z >= 12:
+            return 'HS or more'
+    
+    df['MOTHER_EDU'] = df['HIGHEST_GRADE_COMPLETED_MOTHER'].astype('float64').apply(func)
+    df['FATHER_EDU'] = df['HIGHEST_GRADE_COMPLETED_FATHER'].astype('float64').apply(func)
 
+    return df
+
+# %%
+@profiled
+def get_income_quartile_cutoffs(tnfi_79):
+    """ This function returns the cut points of the quartiles of total net family income
+    in 1978, which are defined for the cohort as a whole.
+    """
+    trunc_data = tnfi_79['TNFI_TRUNC'].dropna()
+
+    return [float(np.percentile(trunc_data, q)) for q in [25, 50, 75]]
+
+# %%
+def get_afqt_percentile_bins():
+    """ This function returns the bins of the AFQT_RAW score for each percentile above the first,
+    as (lower, upper, percentile) with the upper bound included. Scores up to 23.5 are in the 
+    first percentile. Some of the bins overlap, where the later bin applies.
+    """
     infos = []
     infos += [(23.50, 27.00, 2), (27.00, 29.50, 3), (29.50, 32.00, 4), (32.00, 34.00, 5)]
     infos += [(34.00, 36.50, 6), (36.50, 38.00, 7), (38.00, 40.00, 8), (40.00, 41.00, 9)]
@@ -177,9 +324,46 @@ def _test_afqt(df):
 
     infos += [(101.50, 102.50, 98), (102.5, 105.00, 99)]
 
-    for info in infos:
-        lower, upper, value = info
-        cond = (df_internal['AFQT_RAW'] > lower) & (df_internal['AFQT_RAW'] <= upper)
-        df_internal.loc[cond, 'AFQT_PERCENTILES'] = value
+    return infos
+
+# %%
+def get_afqt_percentile_edges():
+    """ This function returns the bins of the AFQT_RAW score as sorted edges, along with the
+    percentile for each score up to the first edge, between two edges, and beyond the last edge.
+    The overlaps between the bins are resolved, so each score falls into exactly one interval.
+    """
+    bins = get_afqt_percentile_bins()
+    edges = np.unique([bound for lower, upper, _ in bins for bound in (lower, upper)])
+
+    # The later bin applies to an interval covered by more than one. There is no percentile
+    # for scores beyond the last edge.
+    percentiles = np.full(len(edges) + 1, np.nan)
+    percentiles[0] = 1
+    for lower, upper, value in bins:
+        percentiles[np.searchsorted(edges, lower) + 1:np.searchsorted(edges, upper) + 1] = value
+
+    return edges, percentiles
 
-    return df_internal['AFQT_PERCENTILES'].equals(df_internal['AFQT_1'])
+# %%
+def get_afqt_percentiles(afqt_raw):
+    """ This function returns the AFQT percentile for each raw score, with NaN for a missing
+    score. The upper bound of each bin is included, see NLSY Attachment 106.
+    """
+    edges, percentiles = get_afqt_percentile_edges()
+
+    # The missing scores are sorted beyond the last edge.
+    return percentiles[np.searchsorted(edges, afqt_raw, side='left')]
+
+# %%
+@profiled
+def _test_afqt(afqt_raw, afqt_1):
+    """ NLSY provides percentile information for AFQT scores, reconstructed here 
+    as a check based on NLSY instructions. The scores are given for each respondent.
+    """
+    # Adjust for missing values here, even though this is also done for all variables
+    # when the panel is created.
+    afqt_raw = np.where(afqt_raw < 0, np.nan, afqt_raw)
+    afqt_1 = np.where(afqt_1 < 0, np.nan, afqt_1)
+
+    # Match ``AFQT_RAW`` to percentile of distribution
+    return np.array_equal(get_afqt_percentiles(afqt_raw), afqt_1, equal_nan=True)
@@ -0,0 +1,35 @@
+"""This file provides the calendar of the survey rounds of the NLSY79. Respondents were
+interviewed annually from 1979 to 1994 and every other year from 1996 on. The employment
+histories cover each week in between, so some information is available for every year.
+"""
+
+# %%
+import numpy as np
+
+
+# %%
+class SurveyCalendar(object):
+    """ This class describes the survey rounds and the annual grid of years around them.
+    """
+    def __init__(self, rounds, base_year):
+
+        # Class attributes
+        self.rounds = list(rounds)
+        self.base_year = base_year
+
+        # All years with any information, i.e. including the years between survey rounds.
+        self.years = list(range(base_year, self.rounds[-1] + 1))
+
+        # The panel has a row for each survey round and the base year. Information about the
+        # base year is collected with the initial interview.
+        self.panel_years = [base_year] + self.rounds
+        self.off_years = [year for year in self.years if year not in self.panel_years]
+
+    def is_off_year(self, years):
+        """ Return whether each of the years falls between two survey rounds.
+        """
+        return np.isin(years, self.off_years)
+
+
+# %%
+CALENDAR = SurveyCalendar(list(range(1979, 1995)) + list(range(1996, 2013, 2)), base_year=1978)
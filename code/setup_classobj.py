@@ -2,17 +2,31 @@
 """This file creates a class object for the data."""
 
 # %%
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+
 import pandas as pd
 import numpy as np
 
 from setup_dct import get_mappings
-from setup_dct import cleaning_highest_grade_attended
-from setup_dct import aggregate_highest_degree_received
+from setup_dct import WEEKS
+from setup_calendar import CALENDAR
+
+from setup_additional_vars import get_employer_conflicts
+
+from setup_derived import add_derived_variables
+from setup_derived import get_panel_derived
 
-from setup_additional_vars import standarize_employer_information
-from setup_additional_vars import aggregate_birth_information
-from setup_additional_vars import calculate_afqt_scores
-from setup_additional_vars import create_is_interviewed
+from setup_store import write_panel
+from setup_store import split_panel
+from setup_store import join_panel
+from setup_store import load_tables
+from setup_store import to_sparse
+from setup_store import read_metadata
+from setup_store import load_off_years
+from setup_profiling import profiled
+from setup_profiling import PROFILER
+from setup_profiling import TRACE_FNAME
 
 # %%
 # This list contains all variables processed for the panel, checked via testing.
@@ -26,20 +40,45 @@ TIME_CONSTANT += ['ROSENBERG_3', 'ROSENBERG_4', 'ROSENBERG_5', 'ROSENBERG_6', 'R
 TIME_CONSTANT += ['ROSENBERG_8', 'ROSENBERG_9', 'ROSENBERG_10']
 TIME_CONSTANT += ['HIGHEST_GRADE_COMPLETED_FATHER', 'HIGHEST_GRADE_COMPLETED_MOTHER']
 
-TIME_VARYING = []
-TIME_VARYING += ['MONTH_OF_BIRTH', 'YEAR_OF_BIRTH', 'SURVEY_YEAR', 'REASON_NONINTERVIEW']
-TIME_VARYING += ['HIGHEST_GRADE_COMPLETED', 'HIGHEST_GRADE_ATTENDED']
-TIME_VARYING += ['HIGHEST_DEGREE_RECEIVED_1', 'HIGHEST_DEGREE_RECEIVED_2']
-TIME_VARYING += ['CPSOCC70', 'INCOME_WAGES_SALARY', 'AMT_WORK_LMT', 'TYPE_WORK_LMT']
-TIME_VARYING += ['POVSTATUS', 'HEALTH_INS', 'MAR_STATUS', 'REGION']
 
-for start in ['EMP_HOURS_WK_', 'EMP_STATUS_WK_']:
-    for week in ['1', '7', '13', '14', '20', '26', '40', '46', '52']:
-        TIME_VARYING += [start + week]
+# %%
+def get_weekly(weeks=WEEKS):
+    """ Return the weekly employment variables for the requested weeks. These are also available
+    for the years between survey rounds.
+    """
+    weekly = []
+    for start in ['EMP_HOURS_WK_', 'EMP_STATUS_WK_']:
+        for week in weeks:
+            weekly += [start + str(week)]
+
+    return weekly
 
-for start in ['WAGE_HOURLY_JOB_', 'CPS_JOB_INDICATOR_JOB_', 'OCCALL70_JOB_']:
-    for job in ['1', '2', '3', '4', '5']:
-        TIME_VARYING += [start + job]
+
+# %%
+def get_time_varying(weeks=WEEKS):
+    """ Return the time-varying variables, with the weekly employment information for the
+    requested weeks.
+    """
+    time_varying = []
+    time_varying += ['MONTH_OF_BIRTH', 'YEAR_OF_BIRTH', 'SURVEY_YEAR', 'REASON_NONINTERVIEW']
+    time_varying += ['HIGHEST_GRADE_COMPLETED', 'HIGHEST_GRADE_ATTENDED']
+    time_varying += ['HIGHEST_DEGREE_RECEIVED_1', 'HIGHEST_DEGREE_RECEIVED_2']
+    time_varying += ['CPSOCC70', 'INCOME_WAGES_SALARY', 'AMT_WORK_LMT', 'TYPE_WORK_LMT']
+    time_varying += ['POVSTATUS', 'HEALTH_INS', 'MAR_STATUS', 'REGION']
+
+    time_varying += get_weekly(weeks)
+
+    for start in ['WAGE_HOURLY_JOB_', 'CPS_JOB_INDICATOR_JOB_', 'OCCALL70_JOB_']:
+        for job in ['1', '2', '3', '4', '5']:
+            time_varying += [start + job]
+
+    return time_varying
+
+
+# %%
+# The variables for the default selection of weeks.
+TIME_VARYING = get_time_varying()
+WEEKLY = get_weekly()
 
 # %%
 # These variables are created during processing and are part of a separate list, 
@@ -51,51 +90,146 @@ for start in ['OCCALL70_MOD_JOB_']:
     for job in ['1', '2', '3', '4', '5']:
         DERIVED_VARS += [start + job]
 
+# %%
+# These variables do not vary over time, so they are stored once for each respondent. The
+# IDENTIFIER remains in the person-year table as a column for the respondent ID.
+RESPONDENT_LEVEL = [varname for varname in TIME_CONSTANT if varname != 'IDENTIFIER']
+RESPONDENT_LEVEL += ['MONTH_OF_BIRTH', 'YEAR_OF_BIRTH', 'AFQT_RAW']
+
+# %%
+# Variables with a lower share of values in the panel are kept as sparse columns in memory. A
+# sparse column stores each value along with its position, which saves memory for a share of
+# up to two thirds, but working with it is slower. Once the panel has the compact data types,
+# see get_sparse_columns, fewer variables take less memory as sparse columns.
+DENSITY_THRESHOLD = 0.5
+
+# %%
+# This dictionary assigns a compact data type to each variable in the panel. The nullable 
+# integer types (capitalized) allow for missing values in the integer codes.
+SCHEMA = dict()
+SCHEMA.update({'IDENTIFIER': 'int32', 'SURVEY_YEAR': 'int16', 'RACE': 'int8', 'GENDER': 'int8'})
+SCHEMA.update({'MONTH_OF_BIRTH': 'int8', 'YEAR_OF_BIRTH': 'int16', 'IS_INTERVIEWED': 'bool'})
+
+# The weekly employment information is covered for any week of the year that can be requested.
+for varname in TIME_CONSTANT + get_time_varying(range(1, 54)) + DERIVED_VARS:
+    if varname in SCHEMA.keys():
+        continue
+    elif varname.startswith(('CPSOCC70', 'OCCALL70_', 'EMP_HOURS_WK_')):
+        SCHEMA[varname] = 'Int16'
+    elif varname.startswith(('WAGE_HOURLY_JOB_', 'INCOME_WAGES_SALARY', 'EMP_STATUS_WK_')):
+        # The employment status refers to a job by the year of the interview and its number.
+        SCHEMA[varname] = 'Int32'
+    elif varname in ['AFQT_RAW']:
+        # The adjusted Numerical Operations score enters with a weight of one half.
+        SCHEMA[varname] = 'float32'
+    else:
+        SCHEMA[varname] = 'Int8'
+
 # %%
 class SourceCls(object):
-    """ This class has methods that prepare the source dataset for further uses.
+    """ This class has methods that prepare the source dataset for further uses. With
+    profile=True, the methods and the functions they call are profiled, see setup_profiling.
+    The weekly employment information is processed for the requested weeks.
     """
-    def __init__(self):
+    def __init__(self, profile=False, weeks=WEEKS):
+
+        # Profiling applies to the whole process, so it stays enabled for other instances.
+        if profile and PROFILER.fname is None:
+            PROFILER.enable()
 
         # Class attributes
+        self.weeks = list(weeks)
         self.survey_years = None
         self.source_wide = None
         self.source_long = None
         self.dct = None
+        self.missing_counts = None
+        self.sparse_report = None
+        self.employer_conflicts = None
+
+        # The weekly employment information for the years between survey rounds.
+        self.source_off_years = None
+
+        # The tables of the panel in the store, joined on first access to source_long.
+        self.respondents = None
+        self.person_years = None
+        self.columns = None
+
+    @property
+    def source_long(self):
+        """ The panel with one row for each respondent and survey year.
+        """
+        if self._source_long is None and self.person_years is not None:
+            self._source_long = join_panel(self.respondents, self.person_years, self.columns)
+            self.respondents, self.person_years = None, None
+
+        return self._source_long
 
-    def read_source(self, num_agents=None):
-        """ Read the original file from the NLSY INVESTIGATOR.
+    @source_long.setter
+    def source_long(self, source_long):
+        self._source_long = source_long
+
+    @profiled
+    def read_source(self, num_agents=None, engine=None):
+        """ Read the original file from the NLSY INVESTIGATOR. Only the columns referenced 
+        in the mappings are read. The multi-threaded parser is used for engine='pyarrow'.
         """
-        self.source_wide = pd.read_csv(r'data/all-variables.csv', nrows=num_agents)
-        
-        survey_years, dct = get_mappings()
+        survey_years, dct = get_mappings(weeks=self.weeks)
 
         self.survey_years = survey_years
         self.dct = dct
 
-    def add_basic_variables(self):
-        """ Add basic variables constructed from the original data.
+        self.source_wide = read_source_wide(dct, num_agents, engine)
+
+    def read_source_chunks(self, chunksize, num_agents=None):
+        """ Read the original file in chunks of respondents. Each chunk is returned as a separate 
+        instance of the class, ready for the transformation to the panel structure.
+        """
+        survey_years, dct = get_mappings(weeks=self.weeks)
+
+        self.survey_years = survey_years
+        self.dct = dct
+
+        usecols = get_source_columns(dct)
+        dtype = {name: 'float32' for name in usecols}
+
+        # The index continues across chunks, so the respondent IDs are maintained.
+        reader = pd.read_csv(r'data/all-variables.csv', usecols=usecols, dtype=dtype,
+                             nrows=num_agents, chunksize=chunksize)
+        for source_wide in reader:
+            chunk_obj = SourceCls(weeks=self.weeks)
+            chunk_obj.survey_years = survey_years
+            chunk_obj.source_wide = source_wide
+            chunk_obj.dct = dct
+
+            yield chunk_obj
+
+    @profiled
+    def add_basic_variables(self, sparse=True):
+        """ Add basic variables constructed from the original data. With sparse=False, the
+        variables with few values are left as dense columns, e.g. for a shard of respondents.
         """
         # Distribute class attributes
         source_long = self.source_long
 
-        # Process birth information
-        source_long = aggregate_birth_information(source_long)
-
-        # Compute the AFQT score 
-        source_long = calculate_afqt_scores(source_long)
+        # The derived variables are computed in the order of their dependencies.
+        varnames = [varname for entry in get_panel_derived() for varname in entry.outputs]
+        source_long = add_derived_variables(source_long, varnames)
 
         # There are no missing values for these variables, so set as integer data type.
         for varname in ['MONTH_OF_BIRTH', 'YEAR_OF_BIRTH']:
             source_long[varname] = source_long[varname].astype('int64')
 
-        source_long = aggregate_highest_degree_received(source_long)
-        source_long = cleaning_highest_grade_attended(source_long)
-        source_long = standarize_employer_information(source_long)
-        source_long = create_is_interviewed(source_long)
+        # The records where the CPSOCC70 information is mapped to more than one job.
+        self.employer_conflicts = get_employer_conflicts(source_long)
 
+        # Variables with few values, e.g. those only available in some survey rounds, are
+        # kept as sparse columns.
         self.source_long = source_long
+        if sparse:
+            self.source_long, self.sparse_report = set_sparse_columns(source_long)
 
+    @profiled
     def transform_wide_to_panel(self):
         """ Transform from wide to long format.
         """
@@ -108,23 +242,27 @@ class SourceCls(object):
         self.source_long = wide_to_long(source_wide, survey_years, dct)
         self._set_missing_values()
 
-    def _set_missing_values(self):
-        """ This ensures a uniform treatment of missing values.
+        # Only the survey rounds remain in the panel, see get_annual_grid() for all years.
+        self.source_long, self.source_off_years = split_off_years(self.source_long, self.weeks)
+
+    def get_annual_grid(self):
+        """ Return the panel with a row for each year in the calendar, including the weekly
+        employment information for the years between survey rounds.
         """
-        # Distribute class attributes
-        source_long = self.source_long
+        return expand_to_annual_grid(self.source_long, self.source_off_years)
 
-        # In the original dataset, missing values are indicated by negative values
-        for varname in TIME_VARYING + TIME_CONSTANT:
-            cond = source_long[varname] < 0
-            if np.sum(cond) > 0:
-                source_long.loc[cond, varname] = np.nan
+    def _set_missing_values(self):
+        """ This ensures a uniform treatment of missing values. The number of recoded values 
+        for each variable is kept for reporting.
+        """
+        self.source_long, self.missing_counts = set_missing_values(self.source_long, self.weeks)
 
+    @profiled
     def testing(self):
         """ This performs some basic consistency checks for the constructed panel.
         """
-        # Distribute class attributes
-        source_long = self.source_long
+        # Distribute class attributes, some checks refer to the years between survey rounds.
+        source_long = self.get_annual_grid()
 
         # There are several variables which can't have a missing value.
         varnames = []
@@ -141,13 +279,8 @@ class SourceCls(object):
         # For all EMP_HOURS_ variables, non-missing values need to be positive
         assert source_long.filter(regex='EMP_HOURS_*').apply(lambda column: (column[column.notnull()] >= 0).all()).all()
     
-        # There are several variables which are not supposed to vary over time.
-        varnames = []
-        varnames += ['IDENTIFIER', 'RACE', 'GENDER', 'MONTH_OF_BIRTH', 'YEAR_OF_BIRTH', 'AFQT_1']
-        varnames += ['AFQT_RAW', 'ASVAB_ALTERED_TESTING', 'SAMPLE_ID']
-        for varname in varnames:
-            np.testing.assert_equal((source_long[varname].notnull().groupby(
-                level='Identifier').std() == 0).all(), True)
+        # The variables which are not supposed to vary over time are checked when the panel is
+        # stored, as split_panel fails if any of them does, see setup_store.
 
         # Racial distribution is given on the NLSY website.
         values = source_long['RACE'].loc[:, 1979].value_counts().values
@@ -175,9 +308,11 @@ class SourceCls(object):
         np.testing.assert_equal([11625, 127, 85, 41, 36], values)
 
         # The variable CPSOCC70 is used to impute OCCALL70_MOD_JOB_1 in 1979 and 1993.
+        # The values are compared, as either variable may be kept as a sparse column.
         for year in [1979, 1993]:
-            cond = source_long['CPSOCC70'][:, year].equals(source_long['OCCALL70_MOD_JOB_1'][:, year])
-            np.testing.assert_equal(cond, True)
+            values = [source_long[varname][:, year].to_numpy(dtype='float64', na_value=np.nan)
+                      for varname in ['CPSOCC70', 'OCCALL70_MOD_JOB_1']]
+            np.testing.assert_array_equal(*values)
 
         ''' Check the distribution of selected variables at random.
         '''
@@ -216,98 +351,393 @@ class SourceCls(object):
 
         # CPSOCC70
         cases = []
-        cases += [[(1979, source_long), (173, 104, 345, 1038, 403, 0, 785, 615, 9, 181, 1295, 253)]]
-        cases += [[(1988, source_long), (1356, 966, 415, 1825, 1016, 0, 1274, 617, 14, 113, 1271, 122)]]
-        cases += [[(1993, source_long), (1276, 909, 313, 1393,  857, 1,  942, 557, 24, 47, 1171, 60)]]
+        cases += [(1979, (173, 104, 345, 1038, 403, 0, 785, 615, 9, 181, 1295, 253))]
+        cases += [(1988, (1356, 966, 415, 1825, 1016, 0, 1274, 617, 14, 113, 1271, 122))]
+        cases += [(1993, (1276, 909, 313, 1393,  857, 1,  942, 557, 24, 47, 1171, 60))]
 
+        # The counts for all years are computed at once.
+        counts = cpsocc_counts(source_long)
         for case in cases:
-            args, rslt = case
-            np.testing.assert_almost_equal(rslt, cpsocc_counts(*args))
+            year, rslt = case
+            np.testing.assert_almost_equal(rslt, counts.loc[year])
 
         # OCCALL70
         cases = []
-        cases += [[(1988, 1, source_long), (24, 6, 5, 15, 8, 0, 10, 9, 0, 2, 32, 2)]]
-        cases += [[(1993, 3, source_long), (43, 18, 16, 51, 35, 1, 47, 23, 1, 1, 68, 3)]]
-        cases += [[(2000, 5, source_long), (8, 8, 1, 7, 15, 0, 17, 8, 0, 1, 21, 0)]]
+        cases += [[(1988, 1), (24, 6, 5, 15, 8, 0, 10, 9, 0, 2, 32, 2)]]
+        cases += [[(1993, 3), (43, 18, 16, 51, 35, 1, 47, 23, 1, 1, 68, 3)]]
+        cases += [[(2000, 5), (8, 8, 1, 7, 15, 0, 17, 8, 0, 1, 21, 0)]]
 
         for case in cases:
-            args, rslt = case
-            np.testing.assert_almost_equal(rslt, occall_counts(*args))
+            (year, num), rslt = case
+            np.testing.assert_almost_equal(rslt, occall_counts(num, source_long).loc[year])
 
         # EMP_STATUS
         cases = []
-        cases += [[(2007, 26, source_long), (6240, 4614, 38, 0, 321, 1464, 9)]]
-        cases += [[(1997, 46, source_long), (7206, 3668, 16, 0, 258, 1464, 73)]]
-        cases += [[(1987, 20, source_long), (8068, 1486, 65, 43, 554, 2171, 299)]]
+        cases += [[(2007, 26), (6240, 4614, 38, 0, 321, 1464, 9)]]
+        cases += [[(1997, 46), (7206, 3668, 16, 0, 258, 1464, 73)]]
+        cases += [[(1987, 20), (8068, 1486, 65, 43, 554, 2171, 299)]]
 
         for case in cases:
-            args, rslt = case
-            np.testing.assert_almost_equal(rslt, emp_status_counts(*args))
+            (year, week), rslt = case
+            if week in self.weeks:
+                np.testing.assert_almost_equal(rslt, emp_status_counts(week, source_long).loc[year])
 
         # EMP_HOURS
         cases = []
-        cases += [[(1992, 14, source_long), (5697, 87, 194, 330, 762, 4009, 876, 379, 151, 74, 78, 0, 49)]]
-        cases += [[(2009, 7, source_long), (6760, 79, 144, 280, 664, 3350, 707, 375, 147, 83, 23, 33, 41)]]
-        cases += [[(2010, 52, source_long), (7170, 68, 111, 278, 558, 3061, 766, 356, 144, 68, 17, 44, 45)]]
+        cases += [[(1992, 14), (5697, 87, 194, 330, 762, 4009, 876, 379, 151, 74, 78, 0, 49)]]
+        cases += [[(2009, 7), (6760, 79, 144, 280, 664, 3350, 707, 375, 147, 83, 23, 33, 41)]]
+        cases += [[(2010, 52), (7170, 68, 111, 278, 558, 3061, 766, 356, 144, 68, 17, 44, 45)]]
 
         for case in cases:
-            args, rslt = case
-            np.testing.assert_almost_equal(rslt, emp_hours_counts(*args))
+            (year, week), rslt = case
+            if week in self.weeks:
+                np.testing.assert_almost_equal(rslt, emp_hours_counts(week, source_long).loc[year])
 
         # WAGE_HOURLY
         cases = []
-        cases += [[(1979, 5, source_long), (0, 3, 6, 45, 26, 8, 1, 3, 0, 1, 0, 1)]]
-        cases += [[(1988, 4, source_long), (0, 2, 2, 6, 59, 76, 67, 53, 42, 15, 10, 52)]]
-        cases += [[(1991, 2, source_long), (0, 26, 44, 41, 97, 323, 327, 262, 180, 182, 119, 647)]]
+        cases += [[(1979, 5), (0, 3, 6, 45, 26, 8, 1, 3, 0, 1, 0, 1)]]
+        cases += [[(1988, 4), (0, 2, 2, 6, 59, 76, 67, 53, 42, 15, 10, 52)]]
+        cases += [[(1991, 2), (0, 26, 44, 41, 97, 323, 327, 262, 180, 182, 119, 647)]]
 
         for case in cases:
-            args, rslt = case
-            np.testing.assert_almost_equal(rslt, wage_hourly_counts(*args))
+            (year, num), rslt = case
+            np.testing.assert_almost_equal(rslt, wage_hourly_counts(num, source_long).loc[year])
 
         # Confirm all included variables are mentioned at the beginning of the file.
-        varnames = TIME_CONSTANT + TIME_VARYING + DERIVED_VARS
+        varnames = TIME_CONSTANT + get_time_varying(self.weeks) + DERIVED_VARS
         np.testing.assert_equal(set(source_long.columns.values), set(varnames))
 
-    def store(self, fname):
-        """ Store the dataset for further processing.
+    @profiled
+    def store(self, fname, append=False):
+        """ Store the dataset for further processing, with compact data types. With append=True,
+        the dataset is added to an existing store.
         """
         # Distribute class attributes
         source_long = self.source_long
 
-        # Write out persistent storage
-        source_long.to_pickle(fname)
+        memory_before = source_long.memory_usage(deep=True).sum()
+        source_long = apply_schema(source_long)
+        memory_after = source_long.memory_usage(deep=True).sum()
+
+        print('Memory footprint: {:.1f} MB before and {:.1f} MB after applying the schema'.format(
+            memory_before / 1e6, memory_after / 1e6))
+
+        source_off_years = apply_schema(self.source_off_years)
+
+        tables = store_panel(source_long, source_off_years, fname, append)
+
+        memory_split = sum(table.memory_usage(deep=True).sum() for table in tables)
+        print('Memory footprint: {:.1f} MB as separate respondent and person-year tables'.format(
+            memory_split / 1e6))
+
+        # The columns kept as sparse columns in the store remain sparse, as when the panel is
+        # loaded. The columns of a store appended to are the ones of its first part.
+        for varname in read_metadata(fname)['sparse_columns']:
+            source_long[varname] = to_sparse(source_long[varname])
 
-    def load(self, fname):
-        """ Store the dataset for further processing.
+        print('Memory footprint: {:.1f} MB with the sparse columns'.format(
+            source_long.memory_usage(deep=True).sum() / 1e6))
+
+        self.source_long = source_long
+        self.source_off_years = source_off_years
+
+    @profiled
+    def load(self, fname, columns=None, years=None):
+        """ Load the dataset for further processing, optionally only some columns and years.
         """
-        # Distribute class attributes
-        self.source_long = pd.read_pickle(fname)
-        print(type(fname))
-        
+        # Distribute class attributes, the panel itself is only joined when it's needed.
+        self.respondents, self.person_years, self.columns = load_tables(fname, columns, years,
+                                                                        sparse=True)
+        self.source_off_years = load_off_years(fname, columns, years)
+        self.source_long = None
+
+
+# %%
+def store_panel(source_long, source_off_years, fname, append=False):
+    """ Write out persistent storage, with the time-constant variables once for each respondent.
+    The variables that take less memory as sparse columns are recorded, so they are loaded as
+    sparse columns. The panel is written the same way by the pipeline, see setup_pipeline.
+    """
+    sparse = get_sparse_columns(source_long)
+
+    return write_panel(source_long, fname, append, RESPONDENT_LEVEL, source_off_years, sparse)
+
+
+# %%
+def get_sparse_columns(df):
+    """ Return the columns that take less memory as sparse columns than in their data types,
+    e.g. the compact data types of the schema.
+    """
+    sparse = []
+    for varname in df.columns:
+        if df[varname].dtype.kind not in 'iuf' or isinstance(df[varname].dtype, pd.SparseDtype):
+            continue
+        if to_sparse(df[varname]).memory_usage(index=False) < df[varname].memory_usage(index=False):
+            sparse += [varname]
+
+    return sparse
+
+
+# %%
+def apply_schema(df):
+    """ Convert the variables to the compact data types in the schema. The conversion fails 
+    if a variable has a value that the data type can't represent exactly.
+    """
+    df = df.copy()
+    for varname in df.columns:
+        if varname not in SCHEMA.keys():
+            continue
+        # The compact data types do not exist as sparse columns, the store records them instead.
+        if isinstance(df[varname].dtype, pd.SparseDtype):
+            df[varname] = df[varname].sparse.to_dense()
+        converted = df[varname].astype(SCHEMA[varname])
+        # Integer types without missing values silently wrap around on overflow.
+        if converted.dtype.kind in 'iu':
+            np.testing.assert_equal((converted == df[varname]).all(), True)
+        df[varname] = converted
+
+    return df
+
+# %%
+def set_sparse_columns(df, threshold=DENSITY_THRESHOLD):
+    """ Convert the float columns with a share of values below the threshold to sparse columns,
+    which leave out the missing values. The panel is returned along with a report on the memory
+    of each converted column.
+    """
+    report = dict()
+    for varname in df.columns:
+        if df[varname].dtype.kind != 'f':
+            continue
+        density = df[varname].notna().mean()
+        if density >= threshold:
+            continue
+        memory_dense = df[varname].memory_usage(index=False)
+        df[varname] = df[varname].astype(pd.SparseDtype(df[varname].dtype, np.nan))
+        report[varname] = (density, memory_dense / 1e6, df[varname].memory_usage(index=False) / 1e6)
+
+    report = pd.DataFrame.from_dict(report, orient='index', columns=['Density', 'Dense (MB)', 'Sparse (MB)'])
+    report['Saving (MB)'] = report['Dense (MB)'] - report['Sparse (MB)']
+
+    return df, report
+
+# %%
+def print_sparse_report(report):
+    """ Print the memory of each sparse column and what it would take as a dense column.
+    """
+    print('{:<32}{:>10}{:>12}{:>12}{:>12}'.format('Sparse column', 'Density', 'Dense (MB)',
+                                                  'Sparse (MB)', 'Saving (MB)'))
+    for varname, row in report.iterrows():
+        print('{:<32}{:>10.2f}{:>12.2f}{:>12.2f}{:>12.2f}'.format(varname, *row))
+    print('{:<32}{:>10}{:>12.2f}{:>12.2f}{:>12.2f}'.format('total', '', *report.iloc[:, 1:].sum()))
+
+# %%
+def print_employer_conflicts(conflicts):
+    """ Print the number of records for each survey year where the CPSOCC indicator takes a
+    value of one for more than one job.
+    """
+    counts = conflicts.groupby(level='Survey Year').size()
 
+    print('{:<32}{:>10}'.format('Employer conflicts', 'Records'))
+    for year, count in counts.items():
+        print('{:<32}{:>10}'.format(year, count))
+    print('{:<32}{:>10}'.format('total', counts.sum()))
 
 # %%
+@profiled
+def read_source_wide(dct, num_agents=None, engine=None):
+    """ Read the original file from the NLSY INVESTIGATOR. Only the columns referenced 
+    in the mappings are read. The multi-threaded parser is used for engine='pyarrow'.
+    """
+    # All values are numeric codes, with missing values indicated by negative numbers. 
+    # A single precision float holds them exactly and still allows for empty cells.
+    usecols = get_source_columns(dct)
+    dtype = {name: 'float32' for name in usecols}
+
+    if engine == 'pyarrow':
+        # The pyarrow parser does not support reading a subset of rows.
+        source_wide = pd.read_csv(r'data/all-variables.csv', usecols=usecols, dtype=dtype,
+                                  engine='pyarrow')
+        if num_agents is not None:
+            source_wide = source_wide.iloc[:num_agents]
+    else:
+        source_wide = pd.read_csv(r'data/all-variables.csv', usecols=usecols, dtype=dtype,
+                                  nrows=num_agents, engine=engine)
+
+    return source_wide
+
+# %%
+@profiled
+def set_missing_values(source_long, weeks=WEEKS):
+    """ This ensures a uniform treatment of missing values. The panel is returned along with 
+    the number of recoded values for each variable.
+    """
+    varnames = get_time_varying(weeks) + TIME_CONSTANT
+    floats = [varname for varname in varnames if source_long[varname].dtype.kind == 'f']
+
+    # In the original dataset, missing values are indicated by negative values. All float
+    # columns are masked at once on their two-dimensional array of values.
+    values = source_long[floats].to_numpy(copy=True)
+    cond = values < 0
+    values[cond] = np.nan
+    source_long[floats] = values
+
+    missing_counts = pd.Series(cond.sum(axis=0), index=floats)
+
+    # The remaining integer columns only change their type if there are missing values.
+    for varname in varnames:
+        if varname in floats:
+            continue
+        cond = source_long[varname] < 0
+        missing_counts[varname] = np.sum(cond)
+        if missing_counts[varname] > 0:
+            source_long[varname] = source_long[varname].where(~cond)
+
+    return source_long, missing_counts[varnames]
+
+# %%
+@profiled
+def split_off_years(df, weeks=WEEKS):
+    """ Split the rows for the years between survey rounds from the panel. Only the weekly
+    employment information is kept for these years, as all other variables are either missing
+    or do not vary over time.
+    """
+    cond = CALENDAR.is_off_year(df.index.get_level_values('Survey Year'))
+
+    columns = ['IDENTIFIER', 'SURVEY_YEAR'] + [varname for varname in get_weekly(weeks) if varname in df.columns]
+    others = [varname for varname in df.columns if varname not in columns + RESPONDENT_LEVEL]
+    np.testing.assert_equal(df.loc[cond, others].isnull().all().all(), True)
+
+    return df.loc[~cond], df.loc[cond, columns]
+
+# %%
+def expand_to_annual_grid(source_long, source_off_years):
+    """ Reconstruct the panel for all years in the calendar. In the years between survey rounds,
+    the variables that do not vary over time are the same as in the survey rounds, nobody is
+    interviewed, and all other variables are missing.
+    """
+    source_off_years = source_off_years.copy()
+
+    respondent_level = [varname for varname in source_long.columns if varname in RESPONDENT_LEVEL]
+    respondents, _ = split_panel(source_long, respondent_level)
+    source_off_years = source_off_years.join(respondents, on='Identifier')
+
+    if 'IS_INTERVIEWED' in source_long.columns:
+        source_off_years['IS_INTERVIEWED'] = False
+
+    df = pd.concat([source_long, source_off_years]).sort_index()
+
+    # Variables that are missing in the years between survey rounds keep their type.
+    return df[source_long.columns].astype(source_long.dtypes.to_dict())
+
+# %%
+def build_panel_in_parallel(fname, jobs, num_agents=None, weeks=WEEKS):
+    """ Build the panel for shards of respondents in separate processes and store it with the
+    shards in their original order. All steps after reading the original file only use the
+    information on each respondent, so the panel is identical to the one built serially.
+    """
+    source_obj = SourceCls(weeks=weeks)
+    source_obj.read_source(num_agents)
+
+    # The shards are contiguous, so the respondent IDs are maintained.
+    source_wide = source_obj.source_wide
+    shards = [idx for idx in np.array_split(np.arange(len(source_wide)), jobs) if len(idx) > 0]
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = []
+        for idx in shards:
+            futures += [executor.submit(_build_shard, source_wide.iloc[idx], source_obj.survey_years,
+                                        source_obj.dct, weeks)]
+        rslts = [future.result() for future in futures]
+
+    source_obj.source_long = pd.concat([rslt[0] for rslt in rslts])
+    source_obj.source_off_years = pd.concat([rslt[1] for rslt in rslts])
+    source_obj.missing_counts = sum(rslt[2] for rslt in rslts)
+    source_obj.employer_conflicts = pd.concat([rslt[3] for rslt in rslts])
+
+    # The share of values in a shard differs from the whole panel, so the sparse columns are
+    # only selected once the shards are combined.
+    source_obj.source_long, source_obj.sparse_report = set_sparse_columns(source_obj.source_long)
+
+    source_obj.store(fname)
+
+    return source_obj
+
+# %%
+def _build_shard(source_wide, survey_years, dct, weeks):
+    """ Build the panel for a shard of respondents in a separate process.
+    """
+    shard_obj = SourceCls(weeks=weeks)
+    shard_obj.survey_years = survey_years
+    shard_obj.source_wide = source_wide
+    shard_obj.dct = dct
+
+    shard_obj.transform_wide_to_panel()
+    shard_obj.add_basic_variables(sparse=False)
+
+    return (shard_obj.source_long, shard_obj.source_off_years, shard_obj.missing_counts,
+            shard_obj.employer_conflicts)
+
+# %%
+def build_panel_in_chunks(fname, chunksize, num_agents=None, weeks=WEEKS):
+    """ Build the panel for one chunk of respondents at a time and append each chunk to the
+    store in the directory fname, so peak memory is bounded by the chunk size instead of the
+    size of the cohort. Statistics for the whole cohort, e.g. the family income quartiles, are
+    derived from the store, see setup_derived.
+    """
+    for num, chunk_obj in enumerate(SourceCls(weeks=weeks).read_source_chunks(chunksize, num_agents)):
+        chunk_obj.transform_wide_to_panel()
+        chunk_obj.add_basic_variables()
+        chunk_obj.store(fname, append=(num > 0))
+
+# %%
+def get_source_columns(dct):
+    """ Return the names of all columns in the original file that are referenced in the mappings.
+    """
+    usecols = []
+    for long_name in dct.keys():
+        for name in dct[long_name].values():
+            if name not in usecols:
+                usecols += [name]
+
+    return usecols
+
+# %%
+@profiled
 def wide_to_long(source_wide, additional_level, dct):
-    """ Set up an empty dataframe in the wide-to-long format with the right index structure. This
+    """ Transform the dataframe from the wide to the long format with the right index structure. This
     maintains the mapping between the index in the datafrmae in the NLSY respondent ID.
     """
     caseid = [x + 1 for x in source_wide.index]
     multi_index = pd.MultiIndex.from_product([caseid, additional_level], names=['Identifier', 'Survey Year'])
-    pd_long = pd.DataFrame(index=multi_index)
 
     # It's useful to have a column that corresponds to each of the two indices.
-    pd_long['IDENTIFIER'] = pd_long.index.get_level_values('Identifier')
-    pd_long['SURVEY_YEAR'] = pd_long.index.get_level_values('Survey Year')
-
-    for long_name in dct.keys():
-        # Initialize the column with missing values.
-        pd_long[long_name] = np.nan
-        for year in additional_level:
-            # For variables not be defined for each year, missing values remain.
-            if year not in dct[long_name].keys():
-                continue
-            # Assign the variable name to the corresponding year.
-            pd_long.loc[(slice(None), year), long_name] = source_wide[dct[long_name][year]].values
+    columns = ['IDENTIFIER', 'SURVEY_YEAR']
+    columns += [long_name for long_name in dct.keys() if long_name not in columns]
+
+    # Locate the source column for each variable and year. For variables not defined 
+    # for each year, missing values remain.
+    sources, targets = [], []
+    for i, long_name in enumerate(columns):
+        if long_name not in dct.keys():
+            continue
+        for j, year in enumerate(additional_level):
+            if year in dct[long_name].keys():
+                sources += [dct[long_name][year]]
+                targets += [(j, i)]
+
+    # Gather all source columns at once and lay them out in a single (respondent x year x 
+    # variable) block, so each row of the reshaped block is one respondent in one year.
+    block = np.full((len(caseid), len(additional_level), len(columns)), np.nan)
+    if sources:
+        idx_year, idx_column = np.array(targets).T
+        block[:, idx_year, idx_column] = source_wide[sources].to_numpy(dtype='float64')
+
+    pd_long = pd.DataFrame(block.reshape(-1, len(columns)), index=multi_index, columns=columns,
+                           copy=False)
+
+    for label, level in [('IDENTIFIER', 'Identifier'), ('SURVEY_YEAR', 'Survey Year')]:
+        if label not in dct.keys():
+            pd_long[label] = pd_long.index.get_level_values(level)
 
     # Some variables do not have any missing values, so they can be made integer data type.
     for varname in ['IDENTIFIER', 'SURVEY_YEAR', 'RACE', 'GENDER']:
@@ -316,90 +746,147 @@ def wide_to_long(source_wide, additional_level, dct):
     return pd_long
 
 # %%
-def cpsocc_counts(year, source_long):
-    """ This function returns counts for each of the bins of the variable CPSOCC70.
+def cpsocc_counts(source_long):
+    """ This function returns counts for each of the bins of the variable CPSOCC70, with a row
+    for each year.
     """
     bins = []
     bins += [(1, 195), (201, 245), (260, 285), (301, 395), (401, 575), (580, 590)]
     bins += [(601, 715), (740, 785), (801, 802), (821, 824), (901, 965), (980, 984)]
 
-    counts = _get_counts_year(source_long['CPSOCC70'], bins, year)
+    counts = get_binned_counts_by_year(source_long['CPSOCC70'], bins)
 
     return counts
 
 # %%
-def occall_counts(year, num, source_long):
-    """ This function returns counts for each of the bins of the variable OCCALL70_.
+def occall_counts(num, source_long):
+    """ This function returns counts for each of the bins of the variable OCCALL70_, with a row
+    for each year.
     """
     bins = []
     bins += [(1, 195), (201, 245), (260, 285), (301, 395), (401, 575), (580, 590), (601, 715)]
     bins += [(740, 785), (801, 802), (821, 824), (901, 965), (980, 984)]
 
-    counts = _get_counts_year(source_long['OCCALL70_JOB_' + str(num)], bins, year)
+    counts = get_binned_counts_by_year(source_long['OCCALL70_JOB_' + str(num)], bins)
 
     return counts
 
 # %%
-def wage_hourly_counts(year, num, source_long):
-    """ This function returns counts for each of the bins of the variable WAGE_HOURLY_JOB_.
+def wage_hourly_counts(num, source_long):
+    """ This function returns counts for each of the bins of the variable WAGE_HOURLY_JOB_, with
+    a row for each year.
     """
     bins = []
     bins += [(0, 1), (1, 99), (100, 199), (200, 299), (300, 399), (400, 499), (500, 599)]
     bins += [(600, 699), (700, 799), (800, 899), (900, 999), (1000, np.inf)]
 
-    counts = _get_counts_year(source_long['WAGE_HOURLY_JOB_' + str(num)], bins, year)
+    counts = get_binned_counts_by_year(source_long['WAGE_HOURLY_JOB_' + str(num)], bins)
 
     return counts
 
 # %%
-def emp_hours_counts(year, week, source_long):
-    """ This function returns counts for each of the bins of the variable EMP_HOURS_WK_.
+def emp_hours_counts(week, source_long):
+    """ This function returns counts for each of the bins of the variable EMP_HOURS_WK_, with a
+    row for each year and the number of missing values in the last column.
     """
     bins = []
     bins += [(0, 0), (1, 9), (10, 19), (20, 29), (30, 39), (40, 49), (50, 59), (60, 69)]
     bins += [(70, 79), (80, 89), (90, 99), (100, np.inf)]
 
     label = 'EMP_HOURS_WK_' + str(week)
-    counts = _get_counts_year(source_long[label], bins, year)
-    counts += [source_long[label].loc[:, year].isnull().sum()]
+    counts = get_binned_counts_by_year(source_long[label], bins)
+    counts['Missing'] = source_long[label].isnull().groupby(level='Survey Year').sum()
 
     return counts
 
 # %%
-def emp_status_counts(year, week, source_long):
-    """ This function returns counts for each of the bins of the variable EMP_STATUS_WK.
+def emp_status_counts(week, source_long):
+    """ This function returns counts for each of the bins of the variable EMP_STATUS_WK, with a
+    row for each year.
     """
     bins = []
     bins += [(100, np.inf), (0, 0), (2, 2), (3, 3), (4, 4), (5, 5), (7, 7)]
 
-    counts = _get_counts_year(source_long['EMP_STATUS_WK_' + str(week)], bins, year)
+    counts = get_binned_counts_by_year(source_long['EMP_STATUS_WK_' + str(week)], bins)
 
     return counts
 
+# %%
+def get_binned_counts(values, bins):
+    """ This function returns the number of values within each of the (lower, upper) bins, with
+    both bounds included. The bins may overlap. All bins are counted in a single pass through 
+    the sorted values, missing values are not counted.
+    """
+    values = np.sort(values[~np.isnan(values)])
+    lower, upper = np.array(bins, dtype='float64').T
+
+    return np.searchsorted(values, upper, side='right') - np.searchsorted(values, lower, side='left')
+
+# %%
+def get_binned_counts_by_year(series, bins):
+    """ This function returns the counts within each bin for all survey years at once, with a
+    row for each year and a column for each bin.
+    """
+    years = series.index.get_level_values('Survey Year').to_numpy()
+    values = series.to_numpy(dtype='float64', na_value=np.nan)
+
+    # Sort the values by year once, so each year is a contiguous slice.
+    idx = np.argsort(years, kind='stable')
+    years, values = years[idx], values[idx]
+
+    labels = np.unique(years)
+    bounds = np.searchsorted(years, labels, side='left').tolist() + [len(years)]
+
+    counts = np.zeros((len(labels), len(bins)), dtype='int64')
+    for i in range(len(labels)):
+        counts[i] = get_binned_counts(values[bounds[i]:bounds[i + 1]], bins)
+
+    columns = pd.MultiIndex.from_tuples(bins, names=['Lower', 'Upper'])
+
+    return pd.DataFrame(counts, index=pd.Index(labels, name='Survey Year'), columns=columns)
+
 # %%
 def _get_counts_year(series, bins, year):
     """ This function gets the counts within each bin of a particular year.
     """
-    counts = []
-    for bounds in bins:
-        lower, upper = bounds
-        counts += [series.loc[:, year].between(lower, upper).sum()]
+    values = series.loc[:, year].to_numpy(dtype='float64', na_value=np.nan)
 
-    return counts
+    return get_binned_counts(values, bins).tolist()
 
 
 # %%
 # Save the object as a pkl file for further analysis.
 if __name__ == '__main__':
 
-    fname = 'data/all-vars.pkl'
-
-    source_obj = SourceCls()
-
-    source_obj.read_source()
-    source_obj.transform_wide_to_panel()
-    source_obj.add_basic_variables()
-    source_obj.store(fname)
+    parser = argparse.ArgumentParser(description='Create the panel from the NLSY79 extract.')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='number of respondents processed at a time (default: all at once)')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of processes, each for a shard of respondents (default: 1)')
+    parser.add_argument('--profile', action='store_true',
+                        help='write a trace of the time and memory of each step to ' + TRACE_FNAME)
+    args = parser.parse_args()
+
+    if args.jobs > 1 and args.chunksize is not None:
+        parser.error('--jobs and --chunksize can not be combined')
+
+    fname = 'data/all-vars'
+
+    source_obj = SourceCls(profile=args.profile)
+
+    if args.jobs > 1:
+        parallel_obj = build_panel_in_parallel(fname, args.jobs)
+        print_sparse_report(parallel_obj.sparse_report)
+        print_employer_conflicts(parallel_obj.employer_conflicts)
+    elif args.chunksize is None:
+        source_obj.read_source()
+        source_obj.transform_wide_to_panel()
+        source_obj.add_basic_variables()
+        print_sparse_report(source_obj.sparse_report)
+        print_employer_conflicts(source_obj.employer_conflicts)
+        source_obj.store(fname)
+    else:
+        build_panel_in_chunks(fname, args.chunksize)
 
     source_obj.load(fname)
     source_obj.testing()
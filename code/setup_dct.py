@@ -9,355 +9,443 @@ for the same question in different years.
 
 # %%
 # Import necessary packages 
+import hashlib
+import pickle
+import os
+from collections import namedtuple
+
 import pandas as pd
 import numpy as np
-import shlex
 from numpy.testing import assert_equal
 
+import setup_calendar
+import setup_matcher
+from setup_matcher import match_rules
+from setup_calendar import CALENDAR
+from setup_profiling import profiled
+
+# %%
+# The parsed sdf files, so each file is only read once per session.
+CATALOGS = dict()
+
+# The resolved mappings are stored here, keyed by a hash of all their inputs.
+CACHE_DIR = 'data/.cache'
+
+# Employment information is extracted for these weeks of each year.
+WEEKS = [1, 7, 13, 14, 20, 26, 40, 46, 52]
+
+# Increase this number whenever the mapping rules change in a way not visible in this file.
+MAPPING_VERSION = 1
+
+# A rule maps the lines in the sdf file that contain all substrings to a variable in the panel.
+# Rules of kind ``constant'' use the first match for all listed years, rules of kind ``per-year''
+# use the year of each match, and rules of kind ``enumerated'' number several matches in a year.
+# Rules of kind ``weekly'' list the continuous week for each year.
+Rule = namedtuple('Rule', ['label', 'substrings', 'kind', 'years'], defaults=[None])
+
+# %%
+@profiled
+def get_mappings(use_cache=True, weeks=WEEKS):
+    """Return the mappings from the persistent cache if none of the inputs changed. 
+    Otherwise resolve them from the sdf file and store them for the next run. The weekly
+    employment information is mapped for the requested weeks of each year.
+    """
+    # The mappings for each selection of weeks are kept separately.
+    prefix = 'mappings-' + hashlib.sha256(str(list(weeks)).encode()).hexdigest()[:8] + '-'
+    fname = os.path.join(CACHE_DIR, prefix + get_mappings_key(weeks) + '.pkl')
+
+    if use_cache and os.path.exists(fname):
+        with open(fname, 'rb') as infile:
+            return pickle.load(infile)
+
+    years, dct_full = resolve_mappings(weeks)
+
+    if use_cache:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Remove the mappings for outdated inputs, they can never be used again.
+        for fname_old in os.listdir(CACHE_DIR):
+            if fname_old.startswith(prefix):
+                os.remove(os.path.join(CACHE_DIR, fname_old))
+        # Write to a temporary file first, so an interrupted run does not leave a broken cache.
+        with open(fname + '.tmp', 'wb') as outfile:
+            pickle.dump((years, dct_full), outfile)
+        os.replace(fname + '.tmp', fname)
+
+    return years, dct_full
+
 
 # %%
-def get_mappings():
+def get_mappings_key(weeks=WEEKS):
+    """Hash the sdf file, the continuous week crosswalk, the requested weeks, and the code
+    that maps between them and the variable names.
+    """
+    hash_ = hashlib.sha256((str(MAPPING_VERSION) + str(list(weeks))).encode())
+    fnames = [r'data/all-variables.sdf', 'data/continuous_week_crosswalk_2012.pkl']
+    fnames += [__file__, setup_matcher.__file__, setup_calendar.__file__]
+    for fname in fnames:
+        with open(fname, 'rb') as infile:
+            hash_.update(hashlib.sha256(infile.read()).digest())
+
+    return hash_.hexdigest()[:16]
+
+
+# %%
+@profiled
+def resolve_mappings(weeks=WEEKS):
     """Map variables by separate cases: for variables that vary by year, and 
     for variables where there are multiple values each year. 
     """
-    # Set up a grid for survey years. Start with 1978; information about 1978 
+    # Set up a grid for all years in the calendar. Start with 1978; information about 1978 
     # employment histories is collected with the initial interview. Note that
     # from 1996 on, the NLSY is generated every other year.  
-    years = range(1978, 2013)
-
-    # Set up a dictionary for variables 
-    dct_full = dict()
+    years = CALENDAR.years
 
-    dct_full.update(process_time_constant(years))
-    dct_full.update(process_multiple_each_year())
-    dct_full.update(process_single_each_year())
-    dct_full.update(process_highest_degree_received())
-    
+    # All rules are resolved together in a single pass through the sdf file.
+    dct_full = resolve_rules(get_rules(years, weeks), get_catalog())
 
     # Finishing
     return years, dct_full
 
 
 # %%
-def get_name(substrings):
-    """Search through the variable descriptions in NLSY sdf file by substrings. 
+def get_rules(years, weeks=WEEKS):
+    """Collect the rules for all variables in the panel.
+    """
+    rules = []
+    rules += rules_time_constant(years)
+    rules += rules_multiple_each_year(weeks)
+    rules += rules_single_each_year()
+    rules += rules_highest_degree_received()
+
+    return rules
+
+
+# %%
+@profiled
+def resolve_rules(rules, catalog=None):
+    """Resolve the reference numbers for a list of rules. The rules are applied in order,
+    so a later rule for the same variable and year replaces an earlier one.
     """
-    if type(substrings) == str:
-        substrings = [substrings]
+    if catalog is None:
+        catalog = get_catalog()
 
-    with open(r'data/all-variables.sdf', 'r') as infile:
-        for line in infile.readlines():
-            is_relevant = [substring in line for substring in substrings]
-            is_relevant = np.all(is_relevant)
-            if not is_relevant:
-                continue
-            # For the string that identifies RACE.
-            line = line.replace("'", '')
-            list_ = shlex.split(line)
-            name = list_[0].replace('.', '')
+    matches = match_rules(catalog.lines, rules)
 
-            return name
+    dct = dict()
+    for rule, positions in zip(rules, matches):
+        if rule.kind == 'constant':
+            # The first matching line applies to all years.
+            if not positions:
+                raise AssertionError('Substrings not found ...')
+            if rule.label not in dct.keys():
+                dct[rule.label] = dict()
+            for year in rule.years:
+                dct[rule.label][year] = catalog.names[positions[0]]
+
+        elif rule.kind == 'per-year':
+            # Each matching line applies to the year it was surveyed.
+            if rule.label not in dct.keys():
+                dct[rule.label] = dict()
+            for pos in positions:
+                dct[rule.label][int(catalog.years[pos])] = catalog.names[pos]
+
+        elif rule.kind == 'weekly':
+            # The matching lines are indexed by their continuous week, which is then
+            # looked up for each year.
+            names = dict()
+            for pos in positions:
+                week = get_continuous_week(catalog.tokens[pos])
+                if week not in names.keys():
+                    names[week] = catalog.names[pos]
+            dct[rule.label] = dict()
+            for year, week in rule.years.items():
+                if week not in names.keys():
+                    raise AssertionError('Substrings not found ...')
+                dct[rule.label][year] = names[week]
+
+        elif rule.kind == 'enumerated':
+            # Several matching lines in the same year are numbered consecutively.
+            counts = dict()
+            for pos in positions:
+                year = int(catalog.years[pos])
+                counts[year] = counts.get(year, 0) + 1
+                label = rule.label + '_' + str(counts[year])
+                if label not in dct.keys():
+                    dct[label] = dict()
+                dct[label][year] = catalog.names[pos]
+
+        else:
+            raise AssertionError
 
-    raise AssertionError('Substrings not found ...')
+    return dct
 
 
 # %%
-def get_year_name(substrings):
-    """Search through the variable descriptions in NLSY sdf file by substrings. 
+def get_continuous_week(tokens):
+    """ Return the continuous week in the description tokens of a line, which follows the
+    token WEEK.
     """
-    if type(substrings) == str:
-        substrings = [substrings]
+    if 'WEEK' not in tokens[:-1] or not tokens[tokens.index('WEEK') + 1].isdigit():
+        raise AssertionError('Continuous week not found in ' + ' '.join(tokens))
+
+    return int(tokens[tokens.index('WEEK') + 1])
+
+
+# %%
+class SdfCatalog(object):
+    """ This class parses the Short Description File once and keeps the reference number, year,
+    and description tokens of each line. It answers queries for lines that contain one or several
+    substrings, all of which are matched in a single pass by match_rules.
+    """
+    def __init__(self, fname=r'data/all-variables.sdf'):
+
+        # Class attributes
+        self.fname = fname
+        self.lines = []
+        self.names = []
+        self.years = []
+        self.tokens = []
+
+        self._read_sdf()
 
-    container = dict()
-    with open(r'data/all-variables.sdf', 'r') as infile:
-        for line in infile.readlines():
-            is_relevant = [substring in line for substring in substrings]
-            is_relevant = np.all(is_relevant)
-            if is_relevant:
-                list_ = shlex.split(line)
-                name = list_[0].replace('.', '')
-                year = int(list_[1])
-                container[year] = name
+    def _read_sdf(self):
+        """ Split each line into its reference number, year, and description tokens.
+        """
+        with open(self.fname, 'r') as infile:
+            for line in infile.readlines():
+                list_ = line.split()
+                if len(list_) < 2:
+                    continue
+                self.lines += [line]
+                self.names += [list_[0].replace('.', '')]
+                self.years += [list_[1]]
+                self.tokens += [list_[2:]]
+
+    def find(self, substrings, year=None):
+        """ Return the reference numbers of the lines that contain all substrings, given as a
+        single string or a list, optionally only those for the year.
+        """
+        if isinstance(substrings, str):
+            substrings = [substrings]
 
-    return container
+        positions, = match_rules(self.lines, [Rule('', substrings, 'per-year')])
+        if year is not None:
+            positions = [pos for pos in positions if self.years[pos] == str(year)]
+
+        return [self.names[pos] for pos in positions]
 
 
 # %%
-def process_time_constant(years):
-    """Process time-constant variables.
-    """    
-    dct_constant = dict()
-
-    dct_constant['RACE'] = dict()
-    substrings = 'RACIAL/ETHNIC COHORT FROM SCREENER'
-    for year in years:
-        dct_constant['RACE'][year] = get_name(substrings)
-
-    dct_constant['IDENTIFIER'] = dict()
-    substrings = 'CASEID'
-    for year in years:
-        dct_constant['IDENTIFIER'][year] = get_name(substrings)
-
-    dct_constant['SAMPLE_ID'] = dict()
-    substrings = 'SAMPLE_ID'
-    for year in years:
-        dct_constant['SAMPLE_ID'][year] = get_name(substrings)
-
-    dct_constant['GENDER'] = dict()
-    substrings = 'SEX OF R'
-    for year in years:
-        dct_constant['GENDER'][year] = get_name(substrings)
-
-    dct_constant['HIGHEST_GRADE_COMPLETED_FATHER'] = dict()
-    substrings = 'HGC-FATHER'
-    for year in years:
-        dct_constant['HIGHEST_GRADE_COMPLETED_FATHER'][year] = get_name(substrings)
-
-    dct_constant['HIGHEST_GRADE_COMPLETED_MOTHER'] = dict()
-    substrings = 'HGC-MOTHER'
-    for year in years:
-        dct_constant['HIGHEST_GRADE_COMPLETED_MOTHER'][year] = get_name(substrings)
-
-        
+@profiled
+def get_catalog(fname=r'data/all-variables.sdf'):
+    """ Return the catalog for the sdf file, parsing the file only on first use.
+    """
+    if fname not in CATALOGS.keys():
+        CATALOGS[fname] = SdfCatalog(fname)
+
+    return CATALOGS[fname]
+
+
+# %%
+def rules_time_constant(years):
+    """Declare the rules for time-constant variables.
+    """
+    infos = []
+    infos += [('RACE', 'RACIAL/ETHNIC COHORT FROM SCREENER'), ('IDENTIFIER', 'CASEID')]
+    infos += [('SAMPLE_ID', 'SAMPLE_ID'), ('GENDER', 'SEX OF R')]
+    infos += [('HIGHEST_GRADE_COMPLETED_FATHER', 'HGC-FATHER')]
+    infos += [('HIGHEST_GRADE_COMPLETED_MOTHER', 'HGC-MOTHER')]
+
     '''ATTITUDE / APTITUDE SCORES 
     '''    
     # ROTTER LOCUS OF CONTROL SCALE 
-    dct_constant['ROTTER_SCORE'] = dict()
-    substrings = 'ROTTER SCALE SCORE'
-    for year in years:
-        dct_constant['ROTTER_SCORE'][year] = get_name(substrings)
-
+    infos += [('ROTTER_SCORE', 'ROTTER SCALE SCORE')]
     for i in range(1, 5):
-        label = 'ROTTER_' + str(i)
-        substrings = 'ROTTER-' + str(i) + 'A'
-        dct_constant[label] = dict()
-        for year in years:
-            dct_constant[label][year] = get_name(substrings)
-            
-    # ROSENBERG SELF-ESTEEM SCORE 
-    dct_constant['ROSENBERG_SCORE'] = dict()
-    substrings = 'SELF-ESTEEM SCORE'
-    for year in years:
-        dct_constant['ROSENBERG_SCORE'][year] = get_name(substrings)
+        infos += [('ROTTER_' + str(i), 'ROTTER-' + str(i) + 'A')]
 
+    # ROSENBERG SELF-ESTEEM SCORE 
+    infos += [('ROSENBERG_SCORE', 'SELF-ESTEEM SCORE')]
     for i in range(1, 11):
-        label = 'ROSENBERG_' + str(i)
-        substrings = 'R030' + str(i + 34) + '.00'
-        dct_constant[label] = dict()
-        for year in years:
-            dct_constant[label][year] = get_name(substrings)
+        infos += [('ROSENBERG_' + str(i), 'R030' + str(i + 34) + '.00')]
 
     # ARMED SERVICES VOCATIONAL APTITUDE BATTERY (ASVAB)
-    dct_constant['ASVAB_ARITHMETIC_REASONING'] = dict()
-    substrings = 'PROFILES, ASVAB VOCATIONAL TEST - SECTION 2-ARITHMETIC REASONING'
-    for year in years:
-        dct_constant['ASVAB_ARITHMETIC_REASONING'][year] = get_name(substrings)
-
-    dct_constant['ASVAB_WORD_KNOWLEDGE'] = dict()
-    substrings = 'PROFILES, ASVAB VOCATIONAL TEST - SECTION 3-WORD KNOWLEDGE'
-    for year in years:
-        dct_constant['ASVAB_WORD_KNOWLEDGE'][year] = get_name(substrings)
-
-    dct_constant['ASVAB_PARAGRAPH_COMPREHENSION'] = dict()
-    substrings = 'PROFILES, ASVAB VOCATIONAL TEST - SECTION 4-PARAGRAPH COMP'
-    for year in years:
-        dct_constant['ASVAB_PARAGRAPH_COMPREHENSION'][year] = get_name(substrings)
-
-    dct_constant['ASVAB_NUMERICAL_OPERATIONS'] = dict()
-    substrings = 'PROFILES, ASVAB VOCATIONAL TEST - SECTION 5-NUMERICAL OPERATIONS'
-    for year in years:
-        dct_constant['ASVAB_NUMERICAL_OPERATIONS'][year] = get_name(substrings)
-
-    dct_constant['ASVAB_ALTERED_TESTING'] = dict()
-    substrings = 'PROFILES, ASVAB VOCATIONAL TEST - NORMAL/ALTERED TESTING'
-    for year in years:
-        dct_constant['ASVAB_ALTERED_TESTING'][year] = get_name(substrings)
+    substring = 'PROFILES, ASVAB VOCATIONAL TEST - '
+    infos += [('ASVAB_ARITHMETIC_REASONING', substring + 'SECTION 2-ARITHMETIC REASONING')]
+    infos += [('ASVAB_WORD_KNOWLEDGE', substring + 'SECTION 3-WORD KNOWLEDGE')]
+    infos += [('ASVAB_PARAGRAPH_COMPREHENSION', substring + 'SECTION 4-PARAGRAPH COMP')]
+    infos += [('ASVAB_NUMERICAL_OPERATIONS', substring + 'SECTION 5-NUMERICAL OPERATIONS')]
+    infos += [('ASVAB_ALTERED_TESTING', substring + 'NORMAL/ALTERED TESTING')]
 
     # ARMED FORCES QUALIFICATION TEST (AFQT)
-    dct_constant['AFQT_1'] = dict()
-    substrings = 'PROFILES, ARMED FORCES QUALIFICATION TEST (AFQT) PERCENTILE SCORE - 1980'
-    for year in years:
-        dct_constant['AFQT_1'][year] = get_name(substrings)
+    substring = 'PROFILES, ARMED FORCES QUALIFICATION TEST (AFQT) PERCENTILE SCORE - 1980'
+    infos += [('AFQT_1', substring)]
+
+    rules = []
+    for label, substring in infos:
+        rules += [Rule(label, [substring], 'constant', years)]
 
-    return dct_constant
+    return rules
 
 
 # %%
-def process_multiple_each_year():
-    """Process variables for employment status, with values for multiple weeks.
+def get_year_weeks(mapping_continuous_week):
+    """Arrange the continuous week numbers by the calendar year in which each week starts. 
+    The result is an array of shape (years, weeks of year), padded with zeros where a year
+    has fewer weeks.
     """
-    dct_multiple = dict()
+    start_years = mapping_continuous_week['Week Start: \nYear']
+    years = start_years.unique()
 
-    # NLSY provides mapping between continuous weeks and the calendar year.
-    mapping_continuous_week = pd.read_pickle('data/continuous_week_crosswalk_2012.pkl')
-    years = mapping_continuous_week['Week Start: \nYear'].unique()
+    # Number the weeks within each year in the order of the crosswalk.
+    week_of_year = mapping_continuous_week.groupby('Week Start: \nYear').cumcount().values
+    year_idx = pd.Index(years).get_indexer(start_years)
 
-    year_weeks = dict()
-    for year in years:
-        year_weeks[year] = []
+    year_weeks = np.zeros((len(years), week_of_year.max() + 1), dtype='int64')
+    year_weeks[year_idx, week_of_year] = mapping_continuous_week['Continuous \nWeek Number'].values
 
-    for index, row in mapping_continuous_week.iterrows():
-        year = row['Week Start: \nYear']
-        year_weeks[year] += [row['Continuous \nWeek Number']]
+    return years, year_weeks
 
-    # Get employment information for some selected weeks.
-    weeks = [1, 7, 13, 14, 20, 26, 40, 46, 52]
 
+# %%
+@profiled
+def rules_multiple_each_year(weeks=WEEKS):
+    """Declare the rules for employment status, with values for multiple weeks.
+    """
+    # NLSY provides mapping between continuous weeks and the calendar year.
+    mapping_continuous_week = pd.read_pickle('data/continuous_week_crosswalk_2012.pkl')
+    years, year_weeks = get_year_weeks(mapping_continuous_week)
+
+    rules = []
     for type_ in ['STATUS', 'HOURS']:
+        if type_ == 'STATUS':
+            substrings = ['LABOR FORCE STATUS', 'WEEK']
+        elif type_ == 'HOURS':
+            substrings = ['HOURS AT ALL JOBS', 'WEEK']
+        else:
+            raise AssertionError
         for week in weeks:
             label, idx = 'EMP_' + type_ + '_WK_' + str(week), week - 1
-            dct_multiple[label] = dict()
-            for year in years:
-                substring = 'WEEK ' + str(year_weeks[year][idx])
-                if type_ == 'STATUS':
-                    substrings = ['LABOR FORCE STATUS', substring]
-                elif type_ == 'HOURS':
-                    substrings = ['HOURS AT ALL JOBS', substring]
-                else:
-                    raise AssertionError
-                dct_multiple[label][year] = get_name(substrings)
+            # Each year in the crosswalk needs a continuous week for each of the weeks.
+            if idx >= year_weeks.shape[1] or not (year_weeks[:, idx] > 0).all():
+                raise AssertionError('Week {} is missing in the continuous week crosswalk'.format(week))
+            continuous_weeks = dict(zip(years.tolist(), year_weeks[:, idx].tolist()))
+            rules += [Rule(label, substrings, 'weekly', continuous_weeks)]
 
-    return dct_multiple
+    return rules
 
 
 # %%
-def process_single_each_year():
-    """Process variables measured once each year.
+def rules_single_each_year():
+    """Declare the rules for variables measured once each year.
     """
-    
-    dct = dict()
+    rules = []
 
     ''' EDUCATION
     '''
-    substrings = 'HIGHEST GRADE ATTENDED'
-    dct['HIGHEST_GRADE_ATTENDED'] = get_year_name(substrings)
-
-    substrings = 'HIGHEST GRADE COMPLETED AS'
-    dct['HIGHEST_GRADE_COMPLETED'] = get_year_name(substrings)
-    
+    rules += [Rule('HIGHEST_GRADE_ATTENDED', ['HIGHEST GRADE ATTENDED'], 'per-year')]
+    rules += [Rule('HIGHEST_GRADE_COMPLETED', ['HIGHEST GRADE COMPLETED AS'], 'per-year')]
 
     ''' MONTH/YEAR OF BIRTH
     '''
-    substrings = 'DATE OF BIRTH - YEAR'
-    dct['YEAR_OF_BIRTH'] = get_year_name(substrings)
-
-    substrings = 'DATE OF BIRTH - MONTH'
-    dct['MONTH_OF_BIRTH'] = get_year_name(substrings)
-    
+    rules += [Rule('YEAR_OF_BIRTH', ['DATE OF BIRTH - YEAR'], 'per-year')]
+    rules += [Rule('MONTH_OF_BIRTH', ['DATE OF BIRTH - MONTH'], 'per-year')]
 
     ''' OCCUPATION VARIABLES 
     '''
     # CPSOCC70
-    substrings = 'OCCUPATION AT CURRENT JOB/MOST RECENT JOB (70 CENSUS 3 DIGIT)'
-    dct['CPSOCC70'] = get_year_name(substrings)
+    substrings = ['OCCUPATION AT CURRENT JOB/MOST RECENT JOB (70 CENSUS 3 DIGIT)']
+    rules += [Rule('CPSOCC70', substrings, 'per-year')]
 
     # OCCALL70
     for i in range(1, 6):
         substrings = ['OCCUPATION (CENSUS 3 DIGIT, 70 CODES)', 'JOB #0' + str(i)]
-        dct['OCCALL70_JOB_' + str(i)] = get_year_name(substrings)
+        rules += [Rule('OCCALL70_JOB_' + str(i), substrings, 'per-year')]
 
     # In 1993, the substring is changed and can't be easily distinguished from CPSOCC70
     for i in range(2, 6):
-        substrings = 'OCCUPATION (CENSUS 3 DIGIT) JOB #0' + str(i)
-        dct['OCCALL70_JOB_' + str(i)].update(get_year_name(substrings))
+        substrings = ['OCCUPATION (CENSUS 3 DIGIT) JOB #0' + str(i)]
+        rules += [Rule('OCCALL70_JOB_' + str(i), substrings, 'per-year')]
 
     # In 1982, the substring for the fourth job contains a 0 instead of an O.
     substrings = ['OCCUPATION (CENSUS 3 DIGIT, 70 C0DES)', 'JOB #04']
-    dct['OCCALL70_JOB_4'].update(get_year_name(substrings))
+    rules += [Rule('OCCALL70_JOB_4', substrings, 'per-year')]
 
     #LINKING OCALLEMP70 and CPSOCC7
     for i in range(1, 6):
         substrings = ['IS JOB #0' + str(i) + ' SAME AS CURRENT JOB?']
-        dct['CPS_JOB_INDICATOR_JOB_' + str(i)] = get_year_name(substrings)
-        
+        rules += [Rule('CPS_JOB_INDICATOR_JOB_' + str(i), substrings, 'per-year')]
 
     '''INCOME AND WAGES 
     '''
     # HOURLY RATE OF PAY JOB 
     for i in range(1, 6):
         substrings = ['HOURLY RATE OF PAY JOB #0' + str(i)]
-        dct['WAGE_HOURLY_JOB_' + str(i)] = get_year_name(substrings)
-    
+        rules += [Rule('WAGE_HOURLY_JOB_' + str(i), substrings, 'per-year')]
+
     # TOTAL INCOME FROM WAGES AND SALARY 
-    substrings = 'TOTAL INCOME FROM WAGES AND SALARY'
-    dct['INCOME_WAGES_SALARY'] = get_year_name(substrings)
-    
+    rules += [Rule('INCOME_WAGES_SALARY', ['TOTAL INCOME FROM WAGES AND SALARY'], 'per-year')]
+
     # POVERTY STATUS 
-    substrings = 'FAMILY POVERTY STATUS IN PRIOR YEAR'
-    dct['POVSTATUS'] = get_year_name(substrings)
+    rules += [Rule('POVSTATUS', ['FAMILY POVERTY STATUS IN PRIOR YEAR'], 'per-year')]
 
     '''HEALTH VARIABLES 
     '''
-    substrings = 'DOES HEALTH LIMIT AMOUNT OF WORK R CAN DO?'
-    dct['AMT_WORK_LMT'] = get_year_name(substrings)
-    
-    substrings = 'DOES HEALTH LIMIT KIND OF WORK R CAN DO?'
-    dct['TYPE_WORK_LMT'] = get_year_name(substrings)
-
-    substrings = 'R COVERED BY ANY HEALTH/HOSPITAL PLAN'
-    dct['HEALTH_INS'] = get_year_name(substrings)
-    
-        
+    rules += [Rule('AMT_WORK_LMT', ['DOES HEALTH LIMIT AMOUNT OF WORK R CAN DO?'], 'per-year')]
+    rules += [Rule('TYPE_WORK_LMT', ['DOES HEALTH LIMIT KIND OF WORK R CAN DO?'], 'per-year')]
+    rules += [Rule('HEALTH_INS', ['R COVERED BY ANY HEALTH/HOSPITAL PLAN'], 'per-year')]
+
     ''' OTHER VARIABLES
     '''
     # MARITAL STATUS 
-    substrings = 'MARITIAL STATUS'
-    dct['MAR_STATUS'] = get_year_name(substrings)
-    
-    # REGION OF RESIDENCE
-    substrings = 'REGION OF CURRENT RESIDENCE'
-    dct['REGION'] = get_year_name(substrings) 
-    
-    # REASON FOR NONINTERVIEW
-    substrings = ['REASON FOR NONINTERVIEW']
-    dct['REASON_NONINTERVIEW'] = get_year_name(substrings)
+    rules += [Rule('MAR_STATUS', ['MARITIAL STATUS'], 'per-year')]
 
+    # REGION OF RESIDENCE
+    rules += [Rule('REGION', ['REGION OF CURRENT RESIDENCE'], 'per-year')]
 
+    # REASON FOR NONINTERVIEW
+    rules += [Rule('REASON_NONINTERVIEW', ['REASON FOR NONINTERVIEW'], 'per-year')]
 
-    return dct
+    return rules
 
 
 # %%
-def process_highest_degree_received():
-    '''This function selects the highest degree ever received by a respondent.
+def rules_highest_degree_received():
+    '''Declare the rule for the highest degree ever received by a respondent. In some 
+    years the question is asked twice, these are stored as separate variables.
     '''
-    # Read in the variable names for highest grade received.
-    def read_highest_degree_received():
-        
-        rslt = dict()
-        with open(r'data/all-variables.sdf', 'r') as infile:
-            for line in infile.readlines():
-                is_relevant = 'HIGHEST DEGREE EVER RECEIVED' in line
+    return [Rule('HIGHEST_DEGREE_RECEIVED', ['HIGHEST DEGREE EVER RECEIVED'], 'enumerated')]
 
-                if not is_relevant:
-                    continue
 
-                list_ = shlex.split(line)
-                variable, year = list_[0].replace('.', ''), int(list_[1])
-                if year not in rslt.keys():
-                    rslt[year] = []
+# %%
+def process_time_constant(years, catalog=None):
+    """Process time-constant variables.
+    """    
+    return resolve_rules(rules_time_constant(years), catalog)
+
 
-                rslt[year] += [variable]
+# %%
+def process_multiple_each_year(catalog=None, weeks=WEEKS):
+    """Process variables for employment status, with values for multiple weeks.
+    """
+    return resolve_rules(rules_multiple_each_year(weeks), catalog)
 
-        return rslt
 
-    rslt = read_highest_degree_received()
+# %%
+def process_single_each_year(catalog=None):
+    """Process variables measured once each year.
+    """
+    return resolve_rules(rules_single_each_year(), catalog)
 
-    dct = dict()
-    for year in rslt.keys():
-        for val in rslt[year]:
-            label = 'HIGHEST_DEGREE_RECEIVED_1'
-            if label in dct.keys():
-                if year in dct[label].keys():
-                    label = 'HIGHEST_DEGREE_RECEIVED_2'
-            if label not in dct.keys():
-                dct[label] = dict()
-            dct[label][year] = val
 
-    return dct
+# %%
+def process_highest_degree_received(catalog=None):
+    '''This function selects the highest degree ever received by a respondent.
+    '''
+    return resolve_rules(rules_highest_degree_received(), catalog)
 
 
 # %%
+@profiled
 def aggregate_highest_degree_received(df):
     """ Merge the information about the highest degree ever received.
     """
@@ -373,6 +461,7 @@ def aggregate_highest_degree_received(df):
 
 
 # %%
+@profiled
 def cleaning_highest_grade_attended(df):
     """ A value of 95 corresponds to UNGRADED.
     """
@@ -0,0 +1,189 @@
+"""This file provides the registry of the derived variables. Each entry declares the columns it
+reads and the columns it creates, so a consumer only computes the derived variables it requests,
+along with those they depend on. The variables derived from the store are kept in the store, under
+a key of their code, their input files, and the version of the store, so they are only computed
+again after a change to any of these.
+"""
+
+# %%
+from collections import namedtuple
+import hashlib
+import os
+
+import pandas as pd
+
+from setup_dct import cleaning_highest_grade_attended
+from setup_dct import aggregate_highest_degree_received
+
+from setup_additional_vars import standarize_employer_information
+from setup_additional_vars import aggregate_birth_information
+from setup_additional_vars import create_family_income_quartile
+from setup_additional_vars import calculate_afqt_scores
+from setup_additional_vars import create_is_interviewed
+from setup_additional_vars import merge_family_income
+from setup_additional_vars import create_edu_category
+from setup_additional_vars import create_parent_edu
+from setup_additional_vars import create_age
+from setup_additional_vars import ASVAB_SECTIONS
+from setup_additional_vars import JOBS
+
+from setup_store import read_metadata
+from setup_store import write_derived
+from setup_store import read_derived
+from setup_store import load_panel
+
+# %%
+# The total net family income in 1978 is provided in a separate file. The path is resolved on
+# import, as the plot scripts change the working directory before the dataset is loaded.
+TNFI_FNAME = os.path.abspath('data/TNFI_TRUNC_79.csv')
+
+# A derived variable computes its output columns from its input columns. An input that is also
+# an output is modified in place. It may also read some files directly, which are part of its key.
+Derived = namedtuple('Derived', ['name', 'func', 'inputs', 'outputs', 'files'], defaults=[()])
+
+
+# %%
+def get_family_income(df):
+    """ Merge the total net family income, keeping the index of the panel.
+    """
+    return merge_family_income(df, pd.read_csv(TNFI_FNAME)).set_axis(df.index)
+
+
+# %%
+def get_panel_derived():
+    """ Return the derived variables that are part of the panel in the store.
+    """
+    varnames = ['OCCALL70_JOB_' + str(job) for job in JOBS]
+    varnames += ['CPS_JOB_INDICATOR_JOB_' + str(job) for job in JOBS]
+
+    entries = []
+    entries += [Derived('birth_information', aggregate_birth_information,
+                        ['YEAR_OF_BIRTH', 'MONTH_OF_BIRTH'], ['YEAR_OF_BIRTH', 'MONTH_OF_BIRTH'])]
+    entries += [Derived('afqt_scores', calculate_afqt_scores,
+                        ASVAB_SECTIONS + ['ASVAB_ALTERED_TESTING', 'AFQT_1'], ['AFQT_RAW'])]
+    entries += [Derived('highest_degree_received', aggregate_highest_degree_received,
+                        ['HIGHEST_DEGREE_RECEIVED_1', 'HIGHEST_DEGREE_RECEIVED_2'], ['HIGHEST_DEGREE_RECEIVED'])]
+    entries += [Derived('highest_grade_attended', cleaning_highest_grade_attended,
+                        ['HIGHEST_GRADE_ATTENDED'], ['HIGHEST_GRADE_ATTENDED'])]
+    entries += [Derived('employer_information', standarize_employer_information,
+                        ['SURVEY_YEAR', 'CPSOCC70'] + varnames, ['OCCALL70_MOD_JOB_' + str(job) for job in JOBS])]
+    entries += [Derived('is_interviewed', create_is_interviewed, ['REASON_NONINTERVIEW'], ['IS_INTERVIEWED'])]
+
+    return entries
+
+
+# %%
+def get_dataset_derived():
+    """ Return the derived variables that are computed from the store for the plots and analysis.
+    """
+    varnames = ['HIGHEST_GRADE_COMPLETED_MOTHER', 'HIGHEST_GRADE_COMPLETED_FATHER']
+
+    entries = []
+    entries += [Derived('family_income', get_family_income, ['IDENTIFIER', 'SURVEY_YEAR'], ['TNFI_TRUNC'],
+                        [TNFI_FNAME])]
+    entries += [Derived('age', create_age, ['SURVEY_YEAR', 'YEAR_OF_BIRTH'], ['AGE'])]
+    entries += [Derived('family_income_quartile', create_family_income_quartile,
+                        ['SURVEY_YEAR', 'TNFI_TRUNC'], ['FAMILY_INCOME_QUARTILE'])]
+    entries += [Derived('edu_category', create_edu_category, ['HIGHEST_DEGREE_RECEIVED'], ['EDU_CATEGORY'])]
+    entries += [Derived('parent_edu', create_parent_edu, varnames, ['MOTHER_EDU', 'FATHER_EDU'])]
+
+    return entries
+
+
+# %%
+def resolve_derived(columns, available=(), entries=None):
+    """ Return the derived variables needed for the columns, each listed after the derived
+    variables it depends on. The available columns are not computed again.
+    """
+    if entries is None:
+        entries = get_panel_derived() + get_dataset_derived()
+
+    producers = {varname: entry for entry in entries for varname in entry.outputs}
+
+    resolved = []
+
+    def _resolve(varname):
+        if varname in available or varname not in producers.keys():
+            return
+
+        entry = producers[varname]
+        if entry in resolved:
+            return
+
+        for name in entry.inputs:
+            if name not in entry.outputs:
+                _resolve(name)
+        resolved.append(entry)
+
+    for varname in columns:
+        _resolve(varname)
+
+    return resolved
+
+
+# %%
+def add_derived_variables(df, columns, entries=None):
+    """ Add the derived columns to the panel, along with the derived variables they depend on.
+    """
+    for entry in resolve_derived(columns, entries=entries):
+        df = entry.func(df)
+
+    return df
+
+
+# %%
+def load_derived_variables(fname, columns, entries=None, use_cache=True):
+    """ Load the columns from the store in the directory fname. Any column not in the store is
+    derived from the columns it depends on, which are read as well, and kept in the store.
+    """
+    metadata = read_metadata(fname)
+
+    resolved = resolve_derived(columns, metadata['columns'], entries)
+    keys = get_derived_keys(resolved, metadata.get('version', ''))
+
+    # Only the requested columns and the inputs of the derived variables are read.
+    varnames = list(columns) + [name for entry in resolved for name in entry.inputs]
+    varnames = [name for name in dict.fromkeys(varnames) if name in metadata['columns']]
+
+    df = load_panel(fname, varnames)
+
+    for entry in resolved:
+        derived = None
+        if use_cache:
+            derived = read_derived(fname, entry.name, keys[entry.name])
+
+        if derived is None:
+            derived = entry.func(df[entry.inputs].copy())[entry.outputs]
+            if use_cache:
+                write_derived(derived, fname, entry.name, keys[entry.name])
+
+        for varname in entry.outputs:
+            df[varname] = derived[varname]
+
+    return df[list(columns)]
+
+
+# %%
+def get_derived_keys(entries, version):
+    """ Return the key of each derived variable, which covers its code, its input files, the
+    version of the store, and the keys of the derived variables it depends on.
+    """
+    # The hash of the code is shared with the pipeline, which imports this file indirectly.
+    from setup_pipeline import get_code_hash
+
+    producers = {varname: entry.name for entry in entries for varname in entry.outputs}
+
+    keys = dict()
+    for entry in entries:
+        hash_ = hashlib.sha256((entry.name + version).encode())
+        hash_.update(get_code_hash(entry.func).encode())
+        for fname in entry.files:
+            with open(fname, 'rb') as infile:
+                hash_.update(hashlib.sha256(infile.read()).digest())
+        for varname in entry.inputs:
+            # The entries are resolved, so each dependency has its key already.
+            if producers.get(varname, entry.name) != entry.name:
+                hash_.update(keys[producers[varname]].encode())
+        keys[entry.name] = hash_.hexdigest()[:16]
+
+    return keys
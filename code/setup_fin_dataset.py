@@ -1,5 +1,6 @@
-"""This file adds Total Net Family Income (TNFI) in 1979 to create income quartiles 
-used in plots and analysis."""
+"""This file adds Total Net Family Income (TNFI) in 1979 to create income quartiles
+used in plots and analysis. Nothing is read on import; the dataset is loaded on first access
+and kept for the rest of the process."""
 
 # %%
 # Import necessary packages
@@ -8,81 +9,81 @@ import os
 import pandas as pd
 import numpy as np
 
+from setup_additional_vars import merge_family_income
+from setup_store import load_panel
+from setup_store import read_metadata
+from setup_derived import load_derived_variables
+from setup_derived import get_dataset_derived
+from setup_derived import TNFI_FNAME
+
 # %%
-# Read in the dataset
-fname = 'data/all-vars.pkl'
-# Read in data for total net family income 
-fname2 = 'data/TNFI_TRUNC_79.csv'
-if not os.path.exists(fname):
-     cwd = os.getcwd()
-     os.chdir('C:/Users/bec10/OneDrive/Desktop/files/repos/aptitude-analysis/')
- 
-     os.chdir(cwd)
+# The panel is read from the store, see setup_store. The path is resolved on import, as the
+# plot scripts change the working directory before the dataset is loaded.
+FNAME = os.path.abspath('data/all-vars')
+
 
 # %%
-OBS_DATASET = pd.read_pickle(fname)
-SURVEY_YEARS = OBS_DATASET['SURVEY_YEAR'].unique()
-TNFI_79 = pd.read_csv(fname2)
-TNFI_79['SURVEY_YEAR'] = 1978
-OBS_DATASET = pd.merge(OBS_DATASET, TNFI_79, how='left', left_on=['IDENTIFIER', 'SURVEY_YEAR'],
-                       right_on=['IDENTIFIER', 'SURVEY_YEAR'])
+class DatasetCls(object):
+    """ This class is a handle for the dataset in the store, which is only read on first
+    access. Each selection of columns is read once and then kept.
+    """
+    def __init__(self, fname=FNAME):
+
+        # Class attributes
+        self.fname = fname
+
+        # The frames read so far, for each selection of columns.
+        self._datasets = dict()
+        self._obs_dataset = None
+
+    @property
+    def survey_years(self):
+        """ The survey years of the panel, from the metadata of the store.
+        """
+        return np.array(read_metadata(self.fname)['survey_years'])
+
+    @property
+    def obs_dataset(self):
+        """ The panel with the total net family income merged.
+        """
+        if self._obs_dataset is None:
+            self._obs_dataset = merge_family_income(load_panel(self.fname), pd.read_csv(TNFI_FNAME))
+
+        return self._obs_dataset
+
+    def get_dataset(self, columns=None):
+        """ Return the observed dataset. Only the requested columns are read or derived, all of
+        them by default. The caller gets a copy, which it may modify.
+        """
+        if columns is None:
+            columns = read_metadata(self.fname)['columns']
+            columns += [varname for entry in get_dataset_derived() for varname in entry.outputs]
+
+        key = tuple(columns)
+        if key not in self._datasets.keys():
+            self._datasets[key] = load_derived_variables(self.fname, columns).reset_index(drop=True)
+
+        return self._datasets[key].copy()
+
+
+# %%
+DATASET = DatasetCls()
+
+
+# %%
+def get_dataset(columns=None):
+    """This function returns the observed dataset. Only the requested columns are read or
+    derived, all of them by default."""
+    return DATASET.get_dataset(columns)
+
 
 # %%
-def get_dataset():
-    """This function returns the observed dataset."""
-    # Add a crude measure for a respondent's age, crude because month of the
-    # interview may not directly align with month of birth.
-    OBS_DATASET['AGE'] = OBS_DATASET['SURVEY_YEAR'] - OBS_DATASET['YEAR_OF_BIRTH']
-    
-    # Construct family income quartile variable
-    trunc_data = OBS_DATASET.loc[OBS_DATASET['SURVEY_YEAR'] == 1978, ['TNFI_TRUNC']].dropna()
-
-    trunc_data.replace(-3, np.nan)
-    trunc_data.replace(-2, np.nan)
-    trunc_data.replace(-1, np.nan)
-    
-    first_q = np.percentile(trunc_data, 25)
-    second_q = np.percentile(trunc_data, 50)
-    third_q = np.percentile(trunc_data, 75)
-
-    OBS_DATASET['FAMILY_INCOME_QUARTILE'] = np.nan
-
-    def func(x):
-        if 'NaN' != x < first_q:
-            return 'first quartile'
-        elif first_q <= x < second_q:
-            return 'second quartile'
-        elif second_q <= x < third_q:
-            return 'third quartile'
-        elif third_q <= x != 'NaN':
-            return 'fourth quartile'
-
-    OBS_DATASET['FAMILY_INCOME_QUARTILE'] = OBS_DATASET['TNFI_TRUNC'].apply(func)
-
-    # Construct categorical education variable
-    def func(y):
-        if y < 1:
-            return 'less than hs'
-        elif y == 1:
-            return 'hs'
-        elif y == 2:
-            return 'assoc'
-        elif 3 <= y <= 4:
-            return 'college'
-        elif 5 <= y <= 7:
-            return 'beyond'
-
-    OBS_DATASET['EDU_CATEGORY'] = OBS_DATASET['HIGHEST_DEGREE_RECEIVED'].apply(func)
-
-    # Construct categorical parental education variables 
-    def func(z):
-        if z <= 11:
-            return 'Less than HS'
-        elif z >= 12:
-            return 'HS or more'
-    
-    OBS_DATASET['MOTHER_EDU'] = OBS_DATASET['HIGHEST_GRADE_COMPLETED_MOTHER'].apply(func)
-    OBS_DATASET['FATHER_EDU'] = OBS_DATASET['HIGHEST_GRADE_COMPLETED_FATHER'].apply(func)
-
-    return OBS_DATASET
+def __getattr__(name):
+    """ The dataset and its survey years are only read when they are accessed.
+    """
+    if name == 'OBS_DATASET':
+        return DATASET.obs_dataset
+    if name == 'SURVEY_YEARS':
+        return DATASET.survey_years
 
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
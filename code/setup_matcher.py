@@ -0,0 +1,96 @@
+""" This file provides a multi-pattern matcher (Aho-Corasick) that finds all substrings
+of interest in a line of text in a single pass, no matter how many substrings there are.
+"""
+
+# %%
+from collections import deque
+
+
+# %%
+class Automaton(object):
+    """ This class compiles a list of patterns into an Aho-Corasick automaton.
+    """
+    def __init__(self, patterns):
+
+        # Class attributes
+        self.patterns = list(patterns)
+        self.goto = [dict()]
+        self.fail = [0]
+        self.output = [[]]
+
+        self._build_trie()
+        self._build_failure_links()
+
+    def _build_trie(self):
+        """ Add each pattern to the trie, recording its index at the final state.
+        """
+        for idx, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state].keys():
+                    self.goto += [dict()]
+                    self.fail += [0]
+                    self.output += [[]]
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state] += [idx]
+
+    def _build_failure_links(self):
+        """ Link each state to the longest proper suffix that is also in the trie.
+        """
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail].keys():
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                # A state also reports all patterns that end in its failure state.
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def search(self, text):
+        """ Return the set of indices of all patterns that occur in the text.
+        """
+        goto, fail, output = self.goto, self.fail, self.output
+
+        found, state = set(), 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+
+        return found
+
+
+# %%
+def match_rules(lines, rules):
+    """ Return, for each rule, the positions of the lines that contain all of its
+    substrings. All rules are matched against each line in one pass.
+    """
+    patterns = sorted({substring for rule in rules for substring in rule.substrings})
+    pattern_idx = {pattern: idx for idx, pattern in enumerate(patterns)}
+
+    # For each pattern, keep track of the rules that require it.
+    required = [set(pattern_idx[substring] for substring in rule.substrings) for rule in rules]
+    pattern_rules = [[] for _ in patterns]
+    for rule_idx, pattern_set in enumerate(required):
+        for idx in pattern_set:
+            pattern_rules[idx] += [rule_idx]
+
+    automaton = Automaton(patterns)
+
+    rslt = [[] for _ in rules]
+    for pos, line in enumerate(lines):
+        counts = dict()
+        for idx in automaton.search(line):
+            for rule_idx in pattern_rules[idx]:
+                counts[rule_idx] = counts.get(rule_idx, 0) + 1
+        for rule_idx, count in counts.items():
+            if count == len(required[rule_idx]):
+                rslt[rule_idx] += [pos]
+
+    return rslt
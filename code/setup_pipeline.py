@@ -0,0 +1,405 @@
+"""This file runs the preparation of the dataset as a pipeline of stages. The output of each
+stage is checkpointed under a hash of its code, its input files, and the stages it depends on,
+so a rerun only recomputes the stages affected by a change.
+"""
+
+# %%
+from collections import namedtuple
+from functools import partial
+import argparse
+import hashlib
+import inspect
+import pickle
+import shutil
+import json
+import time
+import os
+
+import pandas as pd
+import numpy as np
+
+from setup_dct import resolve_mappings
+from setup_dct import WEEKS
+
+from setup_additional_vars import merge_family_income
+from setup_additional_vars import create_categories
+
+from setup_derived import get_panel_derived
+from setup_derived import TNFI_FNAME
+
+from setup_store import read_metadata
+from setup_store import write_frame
+from setup_store import read_frame
+from setup_store import load_panel
+
+from setup_classobj import set_missing_values
+from setup_classobj import read_source_wide
+from setup_classobj import split_off_years
+from setup_classobj import wide_to_long
+from setup_classobj import apply_schema
+from setup_classobj import store_panel
+
+# %%
+# The checkpoints of all stages are stored here.
+CACHE_DIR = 'data/.cache/pipeline'
+
+# The panel is written to the same store as by setup_classobj.
+FNAME = 'data/all-vars'
+
+# Only code in this directory is part of the hash of a stage.
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# These module-level objects are caches for a session, not inputs to any stage.
+IGNORED = ['CATALOGS', 'CACHE_DIR']
+
+# A stage computes its output from the outputs of the stages it depends on, in the order listed.
+# It may also read some files directly, which are part of its hash. A stage that writes outside
+# of its checkpoint has a check whether its output is still in place.
+Stage = namedtuple('Stage', ['name', 'func', 'deps', 'files', 'check'], defaults=[(), None])
+
+
+# %%
+def stage_mappings():
+    """ Resolve the mappings between the variables in the panel and the original file.
+    """
+    return resolve_mappings(WEEKS)
+
+
+# %%
+def stage_source_wide(mappings):
+    """ Read the columns of the original file referenced in the mappings.
+    """
+    _, dct = mappings
+
+    return read_source_wide(dct)
+
+
+# %%
+def stage_wide_to_long(mappings, source_wide):
+    """ Transform the original file to the panel for all years in the calendar.
+    """
+    survey_years, dct = mappings
+
+    return wide_to_long(source_wide, survey_years, dct)
+
+
+# %%
+def stage_missing_values(source_long):
+    """ Recode the missing values and split the years between survey rounds from the panel.
+    """
+    source_long, _ = set_missing_values(source_long.copy(), WEEKS)
+
+    return split_off_years(source_long, WEEKS)
+
+
+# %%
+def stage_derived_variable(func, varnames, panel):
+    """ Compute a derived variable on a copy of the panel and return only the variables it
+    creates or modifies.
+    """
+    source_long, _ = panel
+
+    return func(source_long.copy())[varnames]
+
+
+# %%
+def stage_panel(panel, *derived):
+    """ Combine the panel with all derived variables and apply the compact data types.
+    """
+    source_long, source_off_years = panel
+
+    source_long = source_long.copy()
+    for df in derived:
+        for varname in df.columns:
+            source_long[varname] = df[varname]
+
+    return apply_schema(source_long), apply_schema(source_off_years)
+
+
+# %%
+def stage_store(panel):
+    """ Write the panel to the store and return the version of the store.
+    """
+    store_panel(*panel, FNAME)
+
+    return read_metadata(FNAME)['version']
+
+
+# %%
+def check_store(version):
+    """ Return whether the store is still the version written by the pipeline.
+    """
+    if not os.path.exists(os.path.join(FNAME, 'metadata.json')):
+        return False
+
+    return read_metadata(FNAME)['version'] == version
+
+
+# %%
+def stage_family_income(version):
+    """ Merge the total net family income to the panel in the store.
+    """
+    return merge_family_income(load_panel(FNAME), pd.read_csv(TNFI_FNAME))
+
+
+# %%
+def stage_categories(df):
+    """ Create the categorical variables used across the plots and analysis.
+    """
+    return create_categories(df.copy())
+
+
+# %%
+def get_stages():
+    """ Return all stages of the pipeline, each listed after the stages it depends on.
+    """
+    # Each derived variable of the panel only depends on the panel after the recoding of
+    # missing values, see setup_derived.
+    derived = get_panel_derived()
+
+    stages = []
+    stages += [Stage('mappings', stage_mappings, [],
+                     ['data/all-variables.sdf', 'data/continuous_week_crosswalk_2012.pkl'])]
+    stages += [Stage('source_wide', stage_source_wide, ['mappings'], ['data/all-variables.csv'])]
+    stages += [Stage('wide_to_long', stage_wide_to_long, ['mappings', 'source_wide'])]
+    stages += [Stage('missing_values', stage_missing_values, ['wide_to_long'])]
+
+    for entry in derived:
+        stages += [Stage(entry.name, partial(stage_derived_variable, entry.func, entry.outputs), ['missing_values'])]
+
+    stages += [Stage('panel', stage_panel, ['missing_values'] + [entry.name for entry in derived])]
+    stages += [Stage('store', stage_store, ['panel'], check=check_store)]
+    stages += [Stage('family_income', stage_family_income, ['store'], [TNFI_FNAME])]
+    stages += [Stage('categories', stage_categories, ['family_income'])]
+
+    return stages
+
+
+# %%
+def run_pipeline(stages, targets, use_cache=True):
+    """ Return the outputs of the target stages, along with a report on each stage. A stage is
+    only computed if neither its checkpoint nor the checkpoints of all stages depending on
+    it are available, and its check passes, if any.
+    """
+    keys = get_stage_keys(stages)
+    stages = {stage.name: stage for stage in stages}
+
+    outputs, report = dict(), dict()
+
+    def _get_output(name):
+        if name in outputs.keys():
+            return outputs[name]
+
+        stage = stages[name]
+        fname = os.path.join(CACHE_DIR, name + '-' + keys[name])
+
+        start = time.perf_counter()
+        if use_cache and os.path.exists(fname):
+            outputs[name] = _read_checkpoint(fname)
+            if stage.check is not None and not stage.check(outputs[name]):
+                del outputs[name]
+
+        if name in outputs.keys():
+            report[name] = ('hit', time.perf_counter() - start)
+        else:
+            args = [_get_output(dep) for dep in stage.deps]
+            start = time.perf_counter()
+            outputs[name] = stage.func(*args)
+            report[name] = ('computed', time.perf_counter() - start)
+            if use_cache:
+                _write_checkpoint(outputs[name], fname, name)
+
+        return outputs[name]
+
+    rslt = {name: _get_output(name) for name in targets}
+
+    report = [(name,) + report.get(name, ('skipped', np.nan)) for name in stages.keys()]
+    report = pd.DataFrame(report, columns=['Stage', 'Status', 'Seconds']).set_index('Stage')
+
+    return rslt, report
+
+
+# %%
+def get_stage_keys(stages):
+    """ Return the hash of each stage, which covers its code, its input files, and the hashes
+    of the stages it depends on.
+    """
+    keys = dict()
+    for stage in stages:
+        hash_ = hashlib.sha256(stage.name.encode())
+        hash_.update(get_code_hash(stage.func).encode())
+        for fname in stage.files:
+            with open(fname, 'rb') as infile:
+                hash_.update(hashlib.sha256(infile.read()).digest())
+        for dep in stage.deps:
+            # The stages need to be ordered, so each dependency has its key already.
+            hash_.update(keys[dep].encode())
+        keys[stage.name] = hash_.hexdigest()[:16]
+
+    return keys
+
+
+# %%
+def get_code_hash(func):
+    """ Return a hash of the source code of a function, all functions and classes in this
+    directory that it references, and the module-level constants they use.
+    """
+    sources = dict()
+    _collect_code(func, sources)
+
+    hash_ = hashlib.sha256()
+    for label in sorted(sources.keys()):
+        hash_.update((label + sources[label]).encode())
+
+    return hash_.hexdigest()
+
+
+# %%
+def _collect_code(obj, sources):
+    """ Collect the source code of the object and everything it references, recursively.
+    """
+    if isinstance(obj, partial):
+        for item in [obj.func] + list(obj.args):
+            _collect_code(item, sources)
+        return
+
+    if not (inspect.isfunction(obj) or inspect.isclass(obj)):
+        return
+
+    # The instrumented functions are hashed by the code they wrap, see setup_profiling.
+    obj = inspect.unwrap(obj)
+
+    fname = inspect.getsourcefile(obj)
+    if fname is None or os.path.dirname(os.path.abspath(fname)) != CODE_DIR:
+        return
+
+    label = obj.__module__ + '.' + obj.__qualname__
+    if label in sources.keys():
+        return
+
+    if inspect.isclass(obj):
+        # Classes created by a factory, e.g. the named tuples, have no source of their own.
+        try:
+            sources[label] = inspect.getsource(obj)
+        except OSError:
+            sources[label] = repr(getattr(obj, '_fields', obj.__qualname__))
+        return
+
+    sources[label] = inspect.getsource(obj)
+
+    namespace = obj.__globals__
+    for name in _get_names(obj.__code__):
+        if name not in namespace.keys() or name in IGNORED:
+            continue
+        value = namespace[name]
+        if inspect.isfunction(value) or inspect.isclass(value) or isinstance(value, partial):
+            _collect_code(value, sources)
+        elif name.isupper():
+            # Module-level constants, such as the lists of variables, are part of the code.
+            sources[obj.__module__ + '.' + name] = _get_constant_repr(value)
+
+
+# %%
+def _get_names(code):
+    """ Return all global names used by the code object, including those of nested functions.
+    """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _get_names(const)
+
+    return names
+
+
+# %%
+def _get_constant_repr(value):
+    """ Return a representation of a module-level constant. The attributes of instances of
+    classes in this directory, such as the calendar, are represented instead of the instance.
+    """
+    if type(value).__module__ in _get_local_modules():
+        return type(value).__qualname__ + repr(sorted(vars(value).items()))
+
+    return repr(value)
+
+
+# %%
+def _get_local_modules():
+    """ Return the names of all modules in this directory.
+    """
+    return [fname[:-3] for fname in os.listdir(CODE_DIR) if fname.endswith('.py')]
+
+
+# %%
+def _write_checkpoint(output, fname, name):
+    """ Write the output of a stage and remove its outdated checkpoints. Frames, and tuples of
+    frames, are written as Arrow IPC files, see setup_store. Any other output is pickled.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    for fname_old in os.listdir(CACHE_DIR):
+        if not fname_old.startswith(name + '-'):
+            continue
+        if os.path.isdir(os.path.join(CACHE_DIR, fname_old)):
+            shutil.rmtree(os.path.join(CACHE_DIR, fname_old))
+        else:
+            os.remove(os.path.join(CACHE_DIR, fname_old))
+
+    # Write to a temporary directory first, so an interrupted run does not leave a broken
+    # checkpoint.
+    dirname = fname + '.tmp'
+    os.makedirs(dirname)
+
+    frames = output if isinstance(output, tuple) else (output,)
+    if all(isinstance(frame, pd.DataFrame) for frame in frames):
+        for num, frame in enumerate(frames):
+            write_frame(frame, os.path.join(dirname, '{:d}.arrow'.format(num)))
+        kind = 'tuple' if isinstance(output, tuple) else 'frame'
+    else:
+        with open(os.path.join(dirname, 'output.pkl'), 'wb') as outfile:
+            pickle.dump(output, outfile)
+        kind = 'pickle'
+
+    with open(os.path.join(dirname, 'checkpoint.json'), 'w') as outfile:
+        json.dump({'kind': kind, 'num_frames': len(frames)}, outfile)
+
+    os.replace(dirname, fname)
+
+
+# %%
+def _read_checkpoint(fname):
+    """ Read the output of a stage written by _write_checkpoint.
+    """
+    with open(os.path.join(fname, 'checkpoint.json'), 'r') as infile:
+        info = json.load(infile)
+
+    if info['kind'] == 'pickle':
+        with open(os.path.join(fname, 'output.pkl'), 'rb') as infile:
+            return pickle.load(infile)
+
+    frames = [read_frame(os.path.join(fname, '{:d}.arrow'.format(num))) for num in range(info['num_frames'])]
+
+    return tuple(frames) if info['kind'] == 'tuple' else frames[0]
+
+
+# %%
+def print_report(report):
+    """ Print the status and the wall time of each stage.
+    """
+    print('{:<28}{:>10}{:>10}'.format('Stage', 'Status', 'Seconds'))
+    for name, (status, seconds) in report.iterrows():
+        print('{:<28}{:>10}{:>10.3f}'.format(name, status, seconds))
+    print('{:<28}{:>10}{:>10.3f}'.format('total', '', report['Seconds'].sum()))
+
+
+# %%
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Prepare the dataset with checkpointed stages.')
+    parser.add_argument('--target', default='categories', help='stage to compute (default: categories)')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help='compute all stages without reading or writing checkpoints')
+    args = parser.parse_args()
+
+    # The store is always brought up to date, even if the target is available from its checkpoint.
+    _, report = run_pipeline(get_stages(), ['store', args.target], args.use_cache)
+
+    print_report(report)
@@ -0,0 +1,171 @@
+"""This file provides opt-in instrumentation for the preparation of the dataset. Profiling is
+enabled by setting the environment variable NLSY79_PROFILE to the name of the trace file, or
+with SourceCls(profile=True). Each call of an instrumented function then appends a line to the
+trace in the JSON lines format, with its wall time, CPU time, the increase in peak memory, and
+the number of rows and columns going in and out. If NLSY79_PROFILE_STATS is set to a directory,
+a cProfile dump is written there for each outermost instrumented call, e.g. for each stage.
+"""
+
+# %%
+import functools
+import tracemalloc
+import cProfile
+import json
+import time
+import os
+
+import pandas as pd
+
+# %%
+# The trace is written here for SourceCls(profile=True), unless NLSY79_PROFILE is set.
+TRACE_FNAME = 'data/.cache/profile/trace.jsonl'
+
+
+# %%
+class Profiler(object):
+    """ This class records the calls of the instrumented functions while profiling is enabled.
+    The calls are nested, so the peak memory of an inner call also counts for the outer one.
+    """
+    def __init__(self):
+
+        # Class attributes
+        self.fname = None
+        self.stats_dir = None
+
+        # The running peak of memory for each active call, along with the number of calls.
+        self._stack = []
+        self._num_calls = 0
+
+    def enable(self, fname=TRACE_FNAME, stats_dir=None):
+        """ Enable profiling for the current process. The memory allocations are traced from
+        now on, which slows down the instrumented functions.
+        """
+        for dirname in [os.path.dirname(fname), stats_dir]:
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+
+        self.fname = fname
+        self.stats_dir = stats_dir
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        """ Disable profiling and stop tracing the memory allocations.
+        """
+        self.fname = None
+        self.stats_dir = None
+
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def call(self, func, args, kwargs):
+        """ Call the function and record its resources in the trace.
+        """
+        record = dict()
+        record['name'] = func.__qualname__
+        record['module'] = func.__module__
+        record['depth'] = len(self._stack)
+        record['pid'] = os.getpid()
+        record['start'] = time.time()
+        record['rows_in'], record['columns_in'] = get_shape(args)
+
+        # The peak of the outer call so far is kept before the peak is reset for this one.
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            self._stack[-1] = max(self._stack[-1], peak)
+        tracemalloc.reset_peak()
+        self._stack += [current]
+
+        profile = None
+        if self.stats_dir is not None and record['depth'] == 0:
+            profile = cProfile.Profile()
+            profile.enable()
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            rslt = func(*args, **kwargs)
+        except Exception as err:
+            record['error'] = repr(err)
+            raise
+        finally:
+            record['wall_seconds'] = time.perf_counter() - wall
+            record['cpu_seconds'] = time.process_time() - cpu
+
+            if profile is not None:
+                profile.disable()
+
+            peak = max(self._stack.pop(), tracemalloc.get_traced_memory()[1])
+            record['peak_memory_mb'] = (peak - current) / 1024 ** 2
+            if self._stack:
+                self._stack[-1] = max(self._stack[-1], peak)
+
+            if 'error' not in record.keys():
+                # Methods that return nothing modify the instance instead.
+                record['rows_out'], record['columns_out'] = get_shape([rslt] if rslt is not None else args[:1])
+
+            self._write(record, profile)
+
+        return rslt
+
+    def _write(self, record, profile):
+        """ Append the record to the trace and write the cProfile dump, if any.
+        """
+        self._num_calls += 1
+
+        with open(self.fname, 'a') as outfile:
+            outfile.write(json.dumps(record) + '\n')
+
+        if profile is not None:
+            fname = '{}-{}-{:04d}.pstats'.format(record['name'], record['pid'], self._num_calls)
+            profile.dump_stats(os.path.join(self.stats_dir, fname))
+
+
+# %%
+PROFILER = Profiler()
+
+if os.environ.get('NLSY79_PROFILE'):
+    PROFILER.enable(os.environ['NLSY79_PROFILE'], os.environ.get('NLSY79_PROFILE_STATS'))
+
+
+# %%
+def profiled(func):
+    """ Instrument the function, which is only profiled while profiling is enabled.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if PROFILER.fname is None:
+            return func(*args, **kwargs)
+        return PROFILER.call(func, args, kwargs)
+
+    return wrapper
+
+
+# %%
+def get_shape(args):
+    """ Return the number of rows and columns of the first data frame among the arguments. For
+    an instance of a class, its panel is used or, before the panel is created, its wide data.
+    """
+    for arg in args:
+        if isinstance(arg, tuple):
+            rows, columns = get_shape(arg)
+            if rows is not None:
+                return rows, columns
+        if isinstance(arg, pd.DataFrame):
+            return arg.shape
+        if isinstance(arg, pd.Series):
+            return len(arg), 1
+        # The attributes are accessed directly, so a panel is never loaded only to be measured.
+        attributes = getattr(arg, '__dict__', dict())
+        for name in ['_source_long', 'source_wide']:
+            if isinstance(attributes.get(name), pd.DataFrame):
+                return attributes[name].shape
+
+    return None, None
+
+
+# %%
+def read_trace(fname=TRACE_FNAME):
+    """ Return the trace as a data frame with one row for each call.
+    """
+    return pd.read_json(fname, lines=True)
@@ -0,0 +1,277 @@
+"""This file provides a columnar store for the panel. Each survey year is kept in a separate
+directory of Arrow IPC files, so a consumer can memory-map and read only the years and columns
+it needs. The variables that do not vary over time are kept once per respondent in a separate
+table, which is joined to the person-year table when the panel is loaded. The variables with
+few values are listed in the metadata, so they can be loaded as sparse columns. The information
+for the years between survey rounds is kept in another table. The variables derived from the
+panel on request, see setup_derived, are kept along with the store until it is rewritten.
+"""
+
+# %%
+import shutil
+import uuid
+import json
+import os
+
+import pyarrow as pa
+import pandas as pd
+import numpy as np
+
+# %%
+# The levels of the index of the panel, which are stored along with every selection of columns.
+INDEX_NAMES = ['Identifier', 'Survey Year']
+
+# The directories of the table with one row per respondent and of the table for the years
+# between survey rounds.
+RESPONDENTS = 'RESPONDENTS'
+OFF_YEARS = 'OFF_YEARS'
+
+# The directory of the variables derived from the panel on request.
+DERIVED = 'DERIVED'
+
+
+# %%
+def write_panel(df, fname, append=False, respondent_columns=(), off_years=None, sparse_columns=()):
+    """ Write the panel to the store in the directory fname. The respondent columns are stored
+    once per respondent. The sparse columns are loaded as sparse columns on request. The rows for
+    the years between survey rounds are stored separately, if any. With append=True, the panel
+    is added to the store as a new part, e.g. for another chunk of respondents. The respondent
+    and person-year tables of the store are returned.
+    """
+    if append:
+        metadata = read_metadata(fname)
+    else:
+        # Only ever remove a directory that holds a previous version of the store.
+        if os.path.exists(fname):
+            assert os.path.exists(os.path.join(fname, 'metadata.json'))
+            shutil.rmtree(fname)
+        metadata = dict()
+        metadata['columns'] = list(df.columns)
+        metadata['respondent_columns'] = [name for name in df.columns if name in respondent_columns]
+        metadata['sparse_columns'] = [name for name in df.columns if name in sparse_columns and
+                                      name not in metadata['respondent_columns']]
+        metadata.update({'survey_years': [], 'off_years': [], 'num_parts': 0})
+
+    respondents, person_years = split_panel(df, metadata['respondent_columns'])
+
+    _write_table(respondents, os.path.join(fname, RESPONDENTS), metadata['num_parts'])
+    for year, df_year in person_years.groupby(level='Survey Year', sort=True):
+        _write_table(df_year, os.path.join(fname, 'SURVEY_YEAR=' + str(year)), metadata['num_parts'])
+
+    if off_years is not None:
+        _write_table(off_years, os.path.join(fname, OFF_YEARS), metadata['num_parts'])
+        metadata['off_years'] = sorted(set(metadata['off_years']) | set(
+            int(year) for year in off_years.index.unique(level='Survey Year')))
+
+    metadata['survey_years'] = sorted(set(metadata['survey_years']) | set(
+        int(year) for year in df.index.unique(level='Survey Year')))
+    metadata['num_parts'] += 1
+
+    # Any change to the store gives it a new version, which invalidates the derived variables.
+    metadata['version'] = uuid.uuid4().hex
+
+    with open(os.path.join(fname, 'metadata.json'), 'w') as outfile:
+        json.dump(metadata, outfile)
+
+    return respondents, person_years
+
+
+# %%
+def split_panel(df, respondent_columns):
+    """ Split the panel into a table with one row per respondent for the respondent columns and
+    a table with one row per respondent and survey year for all other columns. The split fails
+    if any of the respondent columns varies over time.
+    """
+    respondents = df[respondent_columns].groupby(level='Identifier', sort=False).first()
+
+    # Broadcasting the respondent table to all years needs to recover the panel exactly.
+    expanded = respondents.reindex(df.index.get_level_values('Identifier')).set_axis(df.index)
+    np.testing.assert_equal(expanded.equals(df[respondent_columns]), True)
+
+    person_years = df.drop(columns=respondent_columns)
+
+    return respondents, person_years
+
+
+# %%
+def join_panel(respondents, person_years, columns):
+    """ Join the respondent table to the person-year table, with the columns in the given order.
+    """
+    if respondents is not None:
+        person_years = person_years.join(respondents, on='Identifier')
+
+    return person_years[columns]
+
+
+# %%
+def load_panel(fname, columns=None, years=None, sparse=False):
+    """ Load the panel from the store in the directory fname. Only the requested columns
+    and survey years are read, all of them by default. With sparse=True, the sparse columns
+    are loaded as sparse columns, which leave out the missing values.
+    """
+    return join_panel(*load_tables(fname, columns, years, sparse))
+
+
+# %%
+def load_tables(fname, columns=None, years=None, sparse=False):
+    """ Load the respondent table and the person-year table from the store in the directory
+    fname, along with the order of the columns in the panel. The respondent table is None if
+    none of its columns is requested. With sparse=True, the sparse columns are loaded as
+    sparse columns.
+    """
+    metadata = read_metadata(fname)
+
+    if columns is None:
+        columns = metadata['columns']
+    if years is None:
+        years = metadata['survey_years']
+
+    respondent_columns = [name for name in columns if name in metadata['respondent_columns']]
+    person_year_columns = [name for name in columns if name not in respondent_columns]
+
+    respondents = None
+    if respondent_columns:
+        respondents = _read_tables(fname, [RESPONDENTS], metadata['num_parts'],
+                                   INDEX_NAMES[:1] + respondent_columns)
+        respondents = respondents.to_pandas().sort_index()
+
+    dirnames = ['SURVEY_YEAR=' + str(year) for year in years]
+    person_years = _read_tables(fname, dirnames, metadata['num_parts'],
+                                INDEX_NAMES + [name for name in person_year_columns if name not in INDEX_NAMES])
+
+    # The store is organized by survey year, so the original order by respondent is restored.
+    person_years = person_years.to_pandas().sort_index()
+
+    # The stores written before the sparse columns were recorded have none.
+    if sparse:
+        for name in person_year_columns:
+            if name in metadata.get('sparse_columns', []):
+                person_years[name] = to_sparse(person_years[name])
+
+    return respondents, person_years, list(columns)
+
+
+# %%
+def to_sparse(values):
+    """ Return the values as a sparse column, which leaves out the missing values. The values
+    are kept in single precision if it holds them exactly.
+    """
+    if values.dtype.kind == 'f':
+        subtype = values.dtype.numpy_dtype if hasattr(values.dtype, 'numpy_dtype') else values.dtype
+    else:
+        subtype = 'float32' if values.dtype.itemsize < 4 else 'float64'
+
+    return values.astype(subtype).astype(pd.SparseDtype(subtype, np.nan))
+
+
+# %%
+def load_off_years(fname, columns=None, years=None):
+    """ Load the table for the years between survey rounds from the store in the directory
+    fname. Only the requested columns and years are read, to the extent they are available.
+    The table is None if the store has none.
+    """
+    metadata = read_metadata(fname)
+
+    if not metadata['off_years']:
+        return None
+
+    fname_part = os.path.join(fname, OFF_YEARS, _get_part_name(0))
+    available = pa.ipc.open_file(pa.memory_map(fname_part)).schema.names
+    if columns is None:
+        columns = available
+
+    columns = INDEX_NAMES + [name for name in columns if name in available and name not in INDEX_NAMES]
+    off_years = _read_tables(fname, [OFF_YEARS], metadata['num_parts'], columns).to_pandas()
+
+    if years is not None:
+        off_years = off_years[off_years.index.get_level_values('Survey Year').isin(years)]
+
+    return off_years.sort_index()
+
+
+# %%
+def write_derived(df, fname, name, key):
+    """ Write the variables derived by the entry name to the store in the directory fname.
+    The key identifies the inputs they are computed from, and outdated versions are removed.
+    """
+    dirname = os.path.join(fname, DERIVED)
+    os.makedirs(dirname, exist_ok=True)
+    for fname_old in os.listdir(dirname):
+        if fname_old.startswith(name + '-'):
+            os.remove(os.path.join(dirname, fname_old))
+
+    write_frame(df, os.path.join(dirname, name + '-' + key + '.arrow'))
+
+
+# %%
+def read_derived(fname, name, key):
+    """ Return the variables derived by the entry name from the store in the directory fname,
+    or None if they are not available for the key.
+    """
+    fname_derived = os.path.join(fname, DERIVED, name + '-' + key + '.arrow')
+    if not os.path.exists(fname_derived):
+        return None
+
+    return read_frame(fname_derived)
+
+
+# %%
+def write_frame(df, fname):
+    """ Write a frame, including its index, to a single Arrow IPC file.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=True)
+
+    # Write to a temporary file first, so an interrupted run does not leave a broken file.
+    with pa.OSFile(fname + '.tmp', 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(fname + '.tmp', fname)
+
+
+# %%
+def read_frame(fname):
+    """ Read a frame written by write_frame.
+    """
+    return pa.ipc.open_file(pa.memory_map(fname)).read_all().to_pandas()
+
+
+# %%
+def read_metadata(fname):
+    """ Return the metadata of the store, i.e. its columns, years and number of parts.
+    """
+    with open(os.path.join(fname, 'metadata.json'), 'r') as infile:
+        return json.load(infile)
+
+
+# %%
+def _write_table(df, dirname, num):
+    """ Write a table, including its index, as a part of the store in the directory dirname.
+    """
+    os.makedirs(dirname, exist_ok=True)
+
+    write_frame(df, os.path.join(dirname, _get_part_name(num)))
+
+
+# %%
+def _read_tables(fname, dirnames, num_parts, columns):
+    """ Read the selected columns from all parts in the directories of the store into a single
+    table.
+    """
+    tables = []
+    for dirname in dirnames:
+        for num in range(num_parts):
+            fname_part = os.path.join(fname, dirname, _get_part_name(num))
+            if not os.path.exists(fname_part):
+                continue
+            # The file is memory-mapped, so only the selected columns are actually read.
+            table = pa.ipc.open_file(pa.memory_map(fname_part)).read_all()
+            tables += [table.select(columns)]
+
+    return pa.concat_tables(tables)
+
+
+# %%
+def _get_part_name(num):
+    """ Return the file name for a part of the store.
+    """
+    return 'part-{:05d}.arrow'.format(num)